@@ -1,6 +1,7 @@
 from fastapi import FastAPI, UploadFile, File, Form
 from typing import List
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from routes import rag_routes, gen_routes, file_routes, web_routes
 
 
@@ -21,6 +22,32 @@ app.include_router(file_routes.router, prefix="/files", tags=["Files"])
 app.include_router(web_routes.router, prefix="/web", tags=["WebSearch"])
 app.include_router(gen_routes.router, prefix="/generate", tags=["Generative Content"])
 
+@app.on_event("startup")
+async def start_warm_up():
+    # Tải model embedding và FAISS index trong nền, server nhận request ngay
+    rag_routes.rag_service.start_warm_up()
+
+@app.on_event("shutdown")
+async def close_web_session():
+    # Đóng connection pool dùng chung của WebSearch, giải phóng các collection và dừng theo dõi thư mục
+    await web_routes.web_search.close()
+    rag_routes.collections.close()
+    rag_routes.rag_service.stop_watcher()
+
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to Agent System"}
\ No newline at end of file
+    return {"message": "Welcome to Agent System"}
+
+@app.get("/health/live")
+def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready():
+    """Trả về 200 khi model embedding và FAISS index đã sẵn sàng, 503 khi đang khởi động"""
+    rag_service = rag_routes.rag_service
+    if rag_service.ready:
+        return {"status": "ready", "index_size": rag_service.index.ntotal, "index_mmapped": rag_service.index_mmapped}
+    if rag_service.warmup_error:
+        return JSONResponse(status_code=503, content={"status": "error", "detail": rag_service.warmup_error})
+    return JSONResponse(status_code=503, content={"status": "starting"})
\ No newline at end of file
@@ -1,44 +1,194 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+import re
+import time
+import asyncio
+from typing import AsyncIterator
+from services.timing import stage_timings
+from services.response_cache import get_response_cache
+from services.context import context_assembler
 
 load_dotenv()
 
+# Cách phân tích prompt trước khi trả lời:
+#   serial: gọi Gemini phân tích rồi mới gửi prompt chính (cách cũ, hai lượt gọi nối tiếp)
+#   concurrent: lượt gọi phân tích chạy song song với bước tìm kiếm RAG
+#   heuristic: phân loại cục bộ bằng từ khóa, không gọi thêm LLM
+#   inline: gộp yêu cầu phân tích vào prompt chính (một lượt gọi)
+PROMPT_ANALYSIS_MODES = ("serial", "concurrent", "heuristic", "inline")
+PROMPT_ANALYSIS_MODE = os.getenv("PROMPT_ANALYSIS_MODE", "inline").lower()
+
+# Từ khóa cho chế độ heuristic
+# Không dùng "giá" đơn lẻ: trùng với câu hỏi về tài liệu như "đánh giá", "giá trị"
+WEB_KEYWORDS = ("hôm nay", "hiện nay", "hiện tại", "mới nhất", "gần đây", "tin tức", "thời tiết", "giá cả",
+                "giá bao nhiêu", "giá vàng", "giá xăng", "giá bán", "tỷ giá", "năm nay", "latest", "news",
+                "today", "current", "price", "weather")
+FILE_KEYWORDS = ("file", "tệp", "tài liệu", "đính kèm", "văn bản", "pdf", "docx", "báo cáo", "document")
+SMALL_TALK_KEYWORDS = ("xin chào", "chào", "cảm ơn", "tạm biệt", "bạn là ai", "bạn khỏe", "hello", "hi",
+                       "thanks", "thank you")
+CHEERFUL_PATTERN = re.compile(r"(haha|hihi|hehe|:\)|:d|=\)\)|!{2,})", re.IGNORECASE)
+
 class LLM:
     def __init__(self):
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        self.model = genai.GenerativeModel("gemini-2.0-flash")
+        self.model_name = "gemini-2.0-flash"
+        self.model = genai.GenerativeModel(self.model_name)
+        if PROMPT_ANALYSIS_MODE not in PROMPT_ANALYSIS_MODES:
+            raise ValueError(f"PROMPT_ANALYSIS_MODE không hợp lệ: {PROMPT_ANALYSIS_MODE} "
+                             f"(hỗ trợ: {', '.join(PROMPT_ANALYSIS_MODES)})")
+        self.analysis_mode = PROMPT_ANALYSIS_MODE
+
+    async def analyze(self, prompt: str) -> str:
+        """Phân tích prompt theo analysis_mode, trả về None ở chế độ inline"""
+        with stage_timings.measure("analysis", self.analysis_mode):
+            if self.analysis_mode == "inline":
+                return None
+            if self.analysis_mode == "heuristic":
+                return self._heuristic_analysis(prompt)
+            return await self._prompt_analysis(prompt)
+
+    def _cache_model(self) -> str:
+        """Phần model trong key của response cache (câu trả lời phụ thuộc cả cách phân tích prompt)"""
+        return f"{self.model_name}:{self.analysis_mode}"
+
+    async def cached_response(self, prompt: str, rag_response: str = None, web_response: str = None,
+                              file_response: str = None, collection: str = None) -> str:
+        """Câu trả lời đã cache cho cùng prompt và context (của collection), None nếu không có hoặc cache bị tắt"""
+        cache = get_response_cache()
+        if cache is None:
+            return None
+        return await asyncio.to_thread(cache.get, prompt, (rag_response, web_response, file_response),
+                                       self._cache_model(), collection)
+
+    async def _store_response(self, prompt: str, rag_response: str, web_response: str, file_response: str, response: str,
+                              collection: str = None):
+        cache = get_response_cache()
+        if cache is not None and response:
+            await asyncio.to_thread(cache.set, prompt, (rag_response, web_response, file_response),
+                                    self._cache_model(), response, collection)
 
-    async def generateContent(self, prompt: str, rag_response: str = None, web_response: str = None, file_response: str = None) -> str:
-        """Tạo nội dung từ prompt và thông tin từ RAG"""
+    async def generateContent(self, prompt: str, rag_response: str = None, web_response: str = None, file_response: str = None,
+                              analysis_response: str = None, check_cache: bool = True, collection: str = None) -> str:
+        """Tạo nội dung từ prompt và thông tin từ RAG
+
+        analysis_response là kết quả phân tích đã có sẵn (ví dụ chạy song song với bước tìm kiếm);
+        nếu không có, prompt được phân tích theo analysis_mode trước khi gọi API.
+        Câu trả lời được lấy từ response cache nếu có; check_cache=False khi người gọi đã kiểm tra cache.
+        collection là collection tài liệu của rag_response (cache được xóa khi collection thay đổi).
+        """
         try:
-            analysis_response = await self._prompt_analysis(prompt)
-            # Kết hợp prompt gốc với thông tin từ RAG
-            combined_prompt = """Dựa trên thông tin sau đây, hãy trả lời câu hỏi một cách tự nhiên và đầy đủ:
+            if check_cache:
+                cached = await self.cached_response(prompt, rag_response, web_response, file_response, collection)
+                if cached is not None:
+                    return cached
+            if analysis_response is None:
+                analysis_response = await self.analyze(prompt)
+            combined_prompt = self._build_prompt(prompt, analysis_response, rag_response, web_response, file_response)
+            
+            # Gọi API để tạo nội dung
+            with stage_timings.measure("generation", self.analysis_mode):
+                response = await self.model.generate_content_async(combined_prompt)
+            await self._store_response(prompt, rag_response, web_response, file_response, response.text, collection)
+            return response.text
+
+        except Exception as e:
+            print(f"Lỗi khi tạo nội dung: {str(e)}")
+            return "Xin lỗi, tôi không thể tạo nội dung lúc này."
+
+    async def generateContentStream(self, prompt: str, rag_response: str = None, web_response: str = None,
+                                    file_response: str = None, analysis_response: str = None,
+                                    check_cache: bool = True, collection: str = None) -> AsyncIterator[str]:
+        """Giống generateContent nhưng trả về từng đoạn văn bản ngay khi Gemini sinh ra
+
+        Khi generator bị đóng giữa chừng (client ngắt kết nối), luồng của Gemini cũng được đóng
+        để dừng việc sinh nội dung phía upstream. Chỉ câu trả lời được stream trọn vẹn mới được cache.
+        """
+        try:
+            if check_cache:
+                cached = await self.cached_response(prompt, rag_response, web_response, file_response, collection)
+                if cached is not None:
+                    yield cached
+                    return
+            if analysis_response is None:
+                analysis_response = await self.analyze(prompt)
+            combined_prompt = self._build_prompt(prompt, analysis_response, rag_response, web_response, file_response)
+            start_time = time.perf_counter()
+            response = await self.model.generate_content_async(combined_prompt, stream=True)
+        except Exception as e:
+            print(f"Lỗi khi tạo nội dung: {str(e)}")
+            yield "Xin lỗi, tôi không thể tạo nội dung lúc này."
+            return
+
+        iterator = response.__aiter__()
+        first_token = True
+        parts = []
+        try:
+            async for chunk in iterator:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunk không có văn bản (ví dụ bị chặn bởi bộ lọc an toàn)
+                    continue
+                if text:
+                    if first_token:
+                        stage_timings.record("first_token", (time.perf_counter() - start_time) * 1000, self.analysis_mode)
+                        first_token = False
+                    parts.append(text)
+                    yield text
+            await self._store_response(prompt, rag_response, web_response, file_response, "".join(parts), collection)
+        except Exception as e:
+            print(f"Lỗi khi tạo nội dung: {str(e)}")
+            yield "Xin lỗi, tôi không thể tạo nội dung lúc này."
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _build_prompt(self, prompt: str, analysis_response: str, rag_response: str = None,
+                      web_response: str = None, file_response: str = None) -> str:
+        """Kết hợp prompt gốc với kết quả phân tích và thông tin từ RAG, web, file đính kèm
+
+        Các nguồn thông tin được cắt để tổng số token không vượt quá PROMPT_CONTEXT_MAX_TOKENS.
+        """
+        sources = context_assembler.fit_sources({"rag": rag_response, "web": web_response, "file": file_response})
+        rag_response, web_response, file_response = sources["rag"], sources["web"], sources["file"]
+        combined_prompt = """Dựa trên thông tin sau đây, hãy trả lời câu hỏi một cách tự nhiên và đầy đủ:
             """
 
-            # Thêm thông tin từ tài liệu nếu rag_response không phải None
-            if rag_response is not None:
-                combined_prompt += f"""
+        # Thêm thông tin từ tài liệu nếu rag_response không phải None
+        if rag_response is not None:
+            combined_prompt += f"""
                 Thông tin từ hệ thống RAG:
                 {rag_response}
                 """
-                
-            if web_response is not None:
-                combined_prompt += f"""
+            
+        if web_response is not None:
+            combined_prompt += f"""
                 Thông tin từ web:
                 {web_response}
                 """
 
-            if file_response is not None:
-                combined_prompt += f"""
+        if file_response is not None:
+            combined_prompt += f"""
                 Thông tin từ file đính kèm:
                 {file_response}
                 """
 
-            # Thêm thông tin từ web (giữ nguyên vì không có điều kiện loại bỏ)
+        if analysis_response is None:
+            # Chế độ inline: yêu cầu mô hình tự phân tích trong cùng một lượt gọi
             combined_prompt += f"""
 
+            Câu hỏi: {prompt}
+
+            Trước khi trả lời, hãy tự phân tích (không trình bày phần phân tích) xem câu hỏi có cần thông tin từ web hay từ file không,
+            và câu hỏi thuộc trạng thái giao tiếp nào (ví dụ: xã giao, nghiêm túc, vui vẻ, ...) để trả lời với giọng điệu phù hợp.
+            Hãy kết hợp thông tin từ tài liệu RAG, web và file đính kèm (nếu có) với kiến thức của bạn để trả lời câu hỏi một cách tự nhiên và đầy đủ."""
+            return combined_prompt
+
+        # Thêm thông tin từ web (giữ nguyên vì không có điều kiện loại bỏ)
+        combined_prompt += f"""
+
             Câu hỏi: {prompt}
             
             Kết quả phân tích prompt:
@@ -46,14 +196,22 @@ class LLM:
 
             Hãy dựa vào kết quả phân tích prompt, kết hợp thông tin từ tài liệu RAG, web và file đính kèm (nếu có) với kiến thức của bạn để trả lời câu hỏi.
             Người dùng không cần quan tâm đến các thông tin phân tích prompt, chỉ cần trả lời câu hỏi một cách tự nhiên và đầy đủ."""
-            
-            # Gọi API để tạo nội dung
-            response = await self.model.generate_content_async(combined_prompt)
-            return response.text
+        return combined_prompt
 
-        except Exception as e:
-            print(f"Lỗi khi tạo nội dung: {str(e)}")
-            return "Xin lỗi, tôi không thể tạo nội dung lúc này."
+    def _heuristic_analysis(self, prompt: str) -> str:
+        """Phân tích prompt bằng từ khóa thay cho một lượt gọi Gemini"""
+        text = prompt.lower()
+        needs_web = any(re.search(rf"(^|\W){re.escape(keyword)}(\W|$)", text) for keyword in WEB_KEYWORDS)
+        needs_file = any(keyword in text for keyword in FILE_KEYWORDS)
+        if any(re.search(rf"(^|\W){re.escape(keyword)}(\W|$)", text) for keyword in SMALL_TALK_KEYWORDS) and len(text.split()) <= 8:
+            tone = "xã giao"
+        elif CHEERFUL_PATTERN.search(text):
+            tone = "vui vẻ"
+        else:
+            tone = "nghiêm túc"
+        return (f"- Cần thông tin từ web: {'có' if needs_web else 'không'}\n"
+                f"- Cần thông tin từ file: {'có' if needs_file else 'không'}\n"
+                f"- Trạng thái giao tiếp: {tone}")
     
     async def _prompt_analysis(self, prompt: str) -> str:
         """Phân tích prompt và trả về các thông tin cần thiết"""
@@ -73,3 +231,13 @@ class LLM:
         except Exception as e:
             print(f"Lỗi khi phân tích prompt: {str(e)}")
             return "Xin lỗi, tôi không thể phân tích prompt lúc này."
+
+
+_shared_llm = None
+
+def get_llm() -> LLM:
+    """Trả về LLM dùng chung cho các service, chỉ khởi tạo ở lần gọi đầu tiên"""
+    global _shared_llm
+    if _shared_llm is None:
+        _shared_llm = LLM()
+    return _shared_llm
@@ -1,29 +1,56 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from services.file_manager import save_file, delete_file, list_files, read_uploaded_file
-from services.vector_db import VectorDB
+import asyncio
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from services.file_manager import save_file, delete_file, list_files, read_uploaded_file, SUPPORTED_EXTENSIONS
+from services.ingestion import IngestionQueue
+from routes.rag_routes import collections, collection_service, require_ready
+from typing import Optional
 from urllib.parse import unquote
 
 router = APIRouter()
-vector_db = VectorDB()
+# File upload được parse, mã hóa và thêm vào index của collection trong worker nền
+ingestion_queue = IngestionQueue(collections)
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    file_path = save_file(file)
-    return {"message": "File uploaded successfully", "file_path": file_path}
+async def upload_file(file: UploadFile = File(...), collection: Optional[str] = None,
+                      rag_service=Depends(collection_service)):
+    saved = await save_file(file, folder=rag_service.uploaded_files_dir)
+    job = None
+    if saved["path"].endswith(SUPPORTED_EXTENSIONS):
+        job = ingestion_queue.submit(saved["path"], saved["file_hash"], collection)
+    return {
+        "message": "File uploaded successfully",
+        "file_path": saved["path"],
+        "size": saved["size"],
+        "file_hash": saved["file_hash"],
+        "job_id": job["id"] if job is not None else None,
+    }
+
+@router.get("/jobs")
+async def ingestion_stats():
+    """Số job đang chờ, số job theo trạng thái và thời gian từng bước (parse, embed, index)"""
+    return ingestion_queue.stats()
+
+@router.get("/jobs/{job_id}")
+async def ingestion_job(job_id: str):
+    """Trạng thái của một job ingestion"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @router.get("/files")
-async def get_files():
-    return {"files": list_files()}
+async def get_files(rag_service=Depends(collection_service)):
+    return {"files": list_files(rag_service.uploaded_files_dir)}
 
 @router.delete("/delete/{file_name}")
-async def delete_uploaded_file(file_name: str):
+async def delete_uploaded_file(file_name: str, rag_service=Depends(require_ready)):
     decoded_filename = unquote(file_name)
     print("delete file: " + decoded_filename)
     
     # Xóa file khỏi hệ thống
-    if delete_file(decoded_filename):
-        # Xóa dữ liệu khỏi database
-        vector_db.delete_file_from_db(decoded_filename)
+    if delete_file(decoded_filename, rag_service.uploaded_files_dir):
+        # Xóa dữ liệu khỏi database và vector của file khỏi FAISS index (trong thread, không chặn event loop)
+        await asyncio.to_thread(rag_service.remove_file, decoded_filename)
         return {"message": "File deleted successfully"}
     raise HTTPException(status_code=404, detail="File not found")
 
@@ -1,5 +1,8 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from services.generator import GeneratorService
+from services.streaming import sse_response
+from services.timing import stage_timings
+from services.response_cache import get_response_cache
 
 router = APIRouter()
 gen_service = GeneratorService()
@@ -7,4 +10,24 @@ gen_service = GeneratorService()
 @router.get("/content")
 async def generate_content(prompt: str, rag_response: str = None, web_response: str = None, file_response: str = None):
     print(file_response)
-    return {"content": await gen_service.generate_content(prompt, rag_response, web_response, file_response)}
\ No newline at end of file
+    return {"content": await gen_service.generate_content(prompt, rag_response, web_response, file_response)}
+
+@router.get("/content/stream")
+async def generate_content_stream(request: Request, prompt: str, rag_response: str = None, web_response: str = None, file_response: str = None):
+    """Stream câu trả lời dạng Server-Sent Events (sự kiện token, done, error)"""
+    return sse_response(request, gen_service.generate_content_stream(prompt, rag_response, web_response, file_response))
+
+
+@router.get("/timings")
+async def generation_timings():
+    """Thời gian theo giai đoạn (analysis, retrieval, generation, first_token, total) của từng chế độ phân tích prompt"""
+    return stage_timings.stats()
+
+
+@router.get("/cache-stats")
+async def response_cache_stats():
+    """Số lần hit/miss và kích thước của response cache"""
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
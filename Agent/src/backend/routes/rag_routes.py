@@ -1,16 +1,145 @@
-from fastapi import APIRouter
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from pydantic import BaseModel
+from typing import List, Optional
 from services.rag import RAGService
+from services.vector_db import make_filters
+from services.streaming import sse_response
+from services.context import context_assembler
+from services.collection_manager import CollectionManager
 
 router = APIRouter()
+# Model và index được tải nền khi server khởi động (xem main.py), không tải lúc import
 rag_service = RAGService()
-rag_service.index_files()
+# Các collection khác được tải khi có request đầu tiên và giải phóng khi vượt giới hạn bộ nhớ
+collections = CollectionManager(rag_service)
+
+async def collection_service(collection: Optional[str] = None):
+    """RAGService của collection được chọn (mặc định: collection mặc định), được giữ đến hết request"""
+    if collection is None:
+        yield rag_service
+        return
+    try:
+        # Tải collection (đọc index, đồng bộ file) trong thread để không chặn event loop
+        service = await asyncio.to_thread(collections.acquire, collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Collection không tồn tại: {collection}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        yield service
+    finally:
+        collections.release(service)
+
+def require_ready(rag_service: RAGService = Depends(collection_service)) -> RAGService:
+    """Trả về 503 khi model và index của collection chưa được tải xong"""
+    if not rag_service.ready:
+        raise HTTPException(status_code=503, detail="Hệ thống RAG đang khởi động, vui lòng thử lại sau")
+    return rag_service
+
+class SearchFilters(BaseModel):
+    files: Optional[List[str]] = None
+    extensions: Optional[List[str]] = None
+    updated_after: Optional[str] = None
+    updated_before: Optional[str] = None
+
+class BatchQuery(SearchFilters):
+    questions: List[str]
+    k: Optional[int] = None
+
+def search_filters(files: Optional[List[str]] = Query(None), extensions: Optional[List[str]] = Query(None),
+                   updated_after: Optional[str] = None, updated_before: Optional[str] = None):
+    """Bộ lọc tìm kiếm theo tên file, đuôi file và khoảng thời gian cập nhật (ISO 8601)"""
+    try:
+        return make_filters(files, extensions, updated_after, updated_before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Bộ lọc không hợp lệ: {str(e)}")
+
+@router.get("/collections")
+async def list_collections():
+    """Các collection trên đĩa, collection đang được tải và bộ nhớ ước tính của các index"""
+    return {"collections": collections.list_collections(), "stats": collections.stats()}
+
+@router.post("/collections/{name}")
+async def create_collection(name: str):
+    """Tạo collection mới (database, FAISS index và thư mục upload riêng)"""
+    try:
+        service = await asyncio.to_thread(collections.acquire, name, True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        return {"message": "Collection created successfully", "name": name, "ntotal": service.index.ntotal}
+    finally:
+        collections.release(service)
 
 @router.get("/query")
-async def rag_query(question: str):
-    return {"response": await rag_service.query(question)}
+async def rag_query(question: str, filters=Depends(search_filters), rag_service=Depends(require_ready)):
+    return {"response": await rag_service.query(question, filters)}
+
+@router.get("/query/stream")
+async def rag_query_stream(request: Request, question: str, filters=Depends(search_filters),
+                           rag_service=Depends(require_ready)):
+    """Stream câu trả lời dạng Server-Sent Events (sự kiện token, done, error)"""
+    # Stream chạy sau khi handler trả về, collection được giữ đến khi stream kết thúc
+    return sse_response(request, collections.hold(rag_service, rag_service.query_stream(question, filters)))
+
+@router.post("/batch-query")
+async def rag_batch_query(query: BatchQuery, rag_service=Depends(require_ready)):
+    """Tìm context cho nhiều câu hỏi trong một lần encode và một lần tìm kiếm FAISS"""
+    if not query.questions:
+        raise HTTPException(status_code=400, detail="Danh sách câu hỏi không được để trống")
+    filters = search_filters(query.files, query.extensions, query.updated_after, query.updated_before)
+    contexts = await rag_service.aretrieve_contexts(query.questions, query.k, filters)
+    return {"results": [{"question": q, "context": c} for q, c in zip(query.questions, contexts)]}
 
 @router.post("/sync-files")
-async def sync_files():
+async def sync_files(rag_service=Depends(require_ready)):
     """Đồng bộ dữ liệu từ uploaded_files vào VectorDB"""
-    updated = rag_service.check_and_update_files()
-    return {"message": "Files synchronized successfully" if updated else "No changes detected"}
+    # Parse, mã hóa và ghi index chạy trong thread để không chặn các request khác (kể cả stream)
+    updated = await asyncio.to_thread(rag_service.check_and_update_files)
+    if not updated:
+        return {"message": "No changes detected"}
+    report = rag_service.last_sync_report
+    return {
+        "message": "Files synchronized successfully",
+        "changed": report.get("changed", 0),
+        "skipped": report.get("skipped", 0),
+        "failed": report.get("failed", {}),
+        "seconds": report.get("seconds"),
+    }
+
+@router.get("/index-stats")
+async def index_stats(rag_service=Depends(collection_service)):
+    """Thống kê lần index gần nhất (số chunks, chunks/s, batch_size), batch tìm kiếm, rerank và theo dõi thư mục"""
+    return {
+        "stats": rag_service.last_index_stats,
+        "retrieval_batches": rag_service.retrieval_batcher.stats(),
+        "reranker": rag_service.reranker.stats() if rag_service.reranker is not None else None,
+        "watcher": rag_service.watcher.stats() if rag_service.watcher is not None else None,
+    }
+
+@router.get("/cache-stats")
+async def cache_stats(rag_service=Depends(collection_service)):
+    """Số lần hit/miss của cache embedding câu hỏi và cache kết quả tìm kiếm"""
+    return rag_service.cache_stats()
+
+@router.get("/context-stats")
+async def context_stats():
+    """Số token đầu vào, đưa vào prompt và bị bỏ khi ghép context (chunk RAG và các nguồn của prompt)"""
+    return context_assembler.stats()
+
+@router.get("/index/recall")
+async def index_recall(k: int = 5, num_queries: int = 100, nprobe: int = None, ef_search: int = None,
+                       rag_service=Depends(require_ready)):
+    """Đo recall@k của FAISS index hiện tại so với tìm kiếm vét cạn (flat)"""
+    return await asyncio.to_thread(rag_service.evaluate_recall, k, num_queries, nprobe, ef_search)
+
+@router.post("/index/rebuild")
+async def rebuild_index(rag_service=Depends(require_ready)):
+    """Dựng lại FAISS index từ các embedding đã lưu (train lại IVF/IVF-PQ)"""
+    await asyncio.to_thread(rag_service.rebuild_index_from_db)
+    return {"message": "Index rebuilt successfully", "ntotal": rag_service.index.ntotal}
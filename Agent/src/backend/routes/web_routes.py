@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from services.web_search import WebSearch
 
 router = APIRouter()
@@ -13,6 +13,10 @@ class SearchQuery(BaseModel):
 class URLQuery(BaseModel):
     url: str
 
+class URLListQuery(BaseModel):
+    urls: List[str]
+    concurrency: Optional[int] = None
+
 @router.post("/search")
 async def search(query: SearchQuery):
     """
@@ -21,7 +25,7 @@ async def search(query: SearchQuery):
     if not query.query:
         raise HTTPException(status_code=400, detail="Query không được để trống")
     
-    results = web_search.search(query.query, query.num_results)
+    results = await web_search.search(query.query, query.num_results)
     return {"results": results}
 
 @router.post("/page-content")
@@ -32,5 +36,28 @@ async def get_page_content(query: URLQuery):
     if not query.url:
         raise HTTPException(status_code=400, detail="URL không được để trống")
     
-    content = web_search.get_page_content(query.url)
-    return {"content": content} 
\ No newline at end of file
+    content = await web_search.get_page_content(query.url)
+    return {"content": content}
+
+@router.post("/pages")
+async def get_pages(query: URLListQuery):
+    """
+    Lấy nội dung nhiều trang web đồng thời, trang lỗi được trả về kèm thông báo lỗi
+    """
+    if not query.urls:
+        raise HTTPException(status_code=400, detail="Danh sách URL không được để trống")
+    if query.concurrency is not None and query.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency phải lớn hơn 0")
+    
+    pages = await web_search.get_pages(query.urls, query.concurrency)
+    failed = sum(1 for page in pages if 'error' in page)
+    return {"pages": pages, "failed": failed}
+
+@router.get("/cache-stats")
+async def page_cache_stats():
+    """
+    Thống kê page cache (hit, hỏi lại server, tải mới, dung lượng) và parser HTML đang dùng
+    """
+    if web_search.page_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **web_search.page_cache.stats()}
@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """Gom các yêu cầu đến gần nhau thành một batch và xử lý batch trong thread pool
+
+    Yêu cầu đầu tiên mở một batch; batch được gửi đi khi đủ max_batch_size yêu cầu
+    hoặc sau max_wait_ms. Tối đa max_concurrency batch được xử lý cùng lúc, trong lúc
+    chờ các yêu cầu mới tiếp tục được gom vào batch kế tiếp.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], executor: Executor,
+                 max_batch_size: int = 32, max_wait_ms: float = 5, max_concurrency: int = 1):
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._queue = None
+        self._slots = None
+        self._worker = None
+        self.num_batches = 0
+        self.num_items = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Gửi một yêu cầu và chờ kết quả của nó"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def stats(self) -> dict:
+        """Số batch đã xử lý và kích thước batch trung bình"""
+        return {
+            "batches": self.num_batches,
+            "items": self.num_items,
+            "avg_batch_size": round(self.num_items / self.num_batches, 2) if self.num_batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    def close(self):
+        """Dừng worker, các yêu cầu còn trong hàng đợi nhận lỗi (gọi được từ thread khác)"""
+        if self._worker is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        self._worker.cancel()
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("MicroBatcher đã dừng"))
+
+    def _ensure_started(self):
+        """Khởi tạo hàng đợi và worker trên event loop hiện tại"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Chờ một slot trống; trong lúc chờ, các yêu cầu mới tích lũy cho batch sau
+            await self._slots.acquire()
+            self._loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: list):
+        try:
+            items = [item for item, _ in batch]
+            results = await self._loop.run_in_executor(self.executor, self.process_batch, items)
+            self.num_batches += 1
+            self.num_items += len(items)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
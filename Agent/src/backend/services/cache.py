@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """Cache LRU trong bộ nhớ, giới hạn số phần tử và thời gian sống (TTL) của mỗi phần tử
+
+    Nếu có max_bytes, tổng kích thước các phần tử (tính bằng sizeof) cũng bị giới hạn;
+    phần tử lớn hơn max_bytes không được cache.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, max_bytes: int = 0,
+                 sizeof: Callable[[Any], int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None, record_miss: bool = True) -> Any:
+        """Lấy giá trị theo key, trả về default nếu không có hoặc đã hết hạn
+
+        record_miss=False dùng cho lần kiểm tra nhanh mà sau đó key sẽ được tra lại,
+        để một lần miss không bị đếm hai lần.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at, size = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.nbytes -= size
+            if record_miss:
+                self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        """Lưu giá trị, loại bỏ phần tử ít được dùng nhất khi vượt quá maxsize"""
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        if self.max_bytes > 0 and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._data[key] = (value, time.monotonic() + self.ttl, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes > 0 and self.nbytes > self.max_bytes):
+                self.nbytes -= self._data.popitem(last=False)[1][2]
+
+    def clear(self):
+        """Xóa toàn bộ cache (giữ nguyên bộ đếm hit/miss)"""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """Số lần hit/miss và kích thước hiện tại của cache"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.nbytes,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,199 @@
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+from typing import Iterable, Iterator, List
+from services.embedding import EMBEDDING_MODEL, get_tokenizer
+
+# token: chia chunk theo số token của tokenizer model embedding; char: chia theo số ký tự (cách cũ)
+CHUNKER = os.getenv("CHUNKER", "token").lower()
+# all-MiniLM-L6-v2 cắt input ở 256 token, trừ 2 token đặc biệt [CLS] và [SEP]
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "254"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Câu dài hơn số ký tự này (văn bản không có dấu câu) được cắt ra để buffer không tăng mãi
+MAX_SENTENCE_CHARS = 20000
+
+# Một chunk: nội dung, vị trí ký tự bắt đầu/kết thúc trong văn bản gốc và số token (None với chunker ký tự)
+Chunk = namedtuple("Chunk", ["content", "start_offset", "end_offset", "token_count"])
+
+# Ranh giới câu: dấu kết thúc câu theo sau là khoảng trắng, hoặc dấu xuống dòng
+SENTENCE_BOUNDARY = re.compile(r"[.!?]+(?:\s+|$)|\n\s*")
+# Tách token xấp xỉ (từ hoặc dấu câu) khi không có tokenizer của model
+FALLBACK_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def _chunk_end(text: str, start: int, chunk_size: int) -> int:
+    """Vị trí kết thúc chunk bắt đầu tại start (kết thúc câu hoặc dấu xuống dòng), text phải dài hơn start + chunk_size"""
+    end = start + chunk_size
+    while end > start and text[end] not in ['.', '!', '?', '\n']:
+        end -= 1
+    if end == start:
+        end = start + chunk_size
+    return end
+
+
+def _next_start(start: int, end: int, chunk_overlap: int) -> int:
+    """Vị trí bắt đầu chunk kế tiếp; bỏ overlap khi chunk ngắn hơn overlap để luôn tiến về phía trước"""
+    return end - chunk_overlap if end - chunk_overlap > start else end
+
+
+class CharChunker:
+    """Chia chunk theo số ký tự, cắt tại dấu kết thúc câu gần nhất (cách chia cũ)"""
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 100):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    @property
+    def signature(self) -> str:
+        return f"char:{self.chunk_size}:{self.chunk_overlap}"
+
+    def split(self, text: str) -> List[Chunk]:
+        return list(self.iter_chunks([text]))
+
+    def iter_chunks(self, blocks: Iterable[str]) -> Iterator[Chunk]:
+        """Tách một luồng văn bản (theo trang hoặc đoạn) thành chunk
+
+        Chỉ phần văn bản chưa được cắt (khoảng một chunk cộng một khối) được giữ trong bộ nhớ,
+        overlap được mang sang qua ranh giới giữa các trang.
+        """
+        buffer = ""
+        base = 0
+        for block in blocks:
+            buffer += block
+            start = 0
+            while len(buffer) - start > self.chunk_size:
+                end = _chunk_end(buffer, start, self.chunk_size)
+                yield Chunk(buffer[start:end], base + start, base + end, None)
+                start = _next_start(start, end, self.chunk_overlap)
+            buffer = buffer[start:]
+            base += start
+        if buffer:
+            yield Chunk(buffer, base, base + len(buffer), None)
+
+
+class TokenChunker:
+    """Chia chunk theo số token của tokenizer model embedding, cắt tại ranh giới câu
+
+    Ranh giới câu được tìm bằng một lần quét regex, số token của các câu được tính theo
+    batch, sau đó các câu được gom tham lam đến max_tokens. Overlap gồm các câu cuối của
+    chunk trước với tổng số token không quá overlap_tokens. Câu dài hơn max_tokens được
+    cắt theo vị trí token. Toàn bộ quá trình tuyến tính theo độ dài văn bản.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 model_name: str = EMBEDDING_MODEL):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.model_name = model_name
+        self.tokenizer = get_tokenizer(model_name)
+        if self.tokenizer is None:
+            print("Không tải được tokenizer của model, đếm token xấp xỉ theo từ")
+
+    @property
+    def signature(self) -> str:
+        tokenizer = self.model_name if self.tokenizer is not None else "regex"
+        return f"token:{self.max_tokens}:{self.overlap_tokens}:{tokenizer}"
+
+    def split(self, text: str) -> List[Chunk]:
+        return list(self.iter_chunks([text]))
+
+    def token_spans(self, texts: List[str]) -> List[list]:
+        """Vị trí (start, end) của từng token trong mỗi văn bản, không tính token đặc biệt"""
+        if not texts:
+            return []
+        if self.tokenizer is None:
+            return [[match.span() for match in FALLBACK_TOKEN.finditer(text)] for text in texts]
+        encoded = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True,
+                                 return_attention_mask=False, return_token_type_ids=False)
+        return [list(offsets) for offsets in encoded["offset_mapping"]]
+
+    def _iter_sentences(self, blocks: Iterable[str]) -> Iterator[tuple]:
+        """Sinh các câu (text, start_offset, token_spans), các câu nối tiếp nhau phủ toàn bộ văn bản"""
+        buffer = ""
+        base = 0
+        for block in blocks:
+            buffer += block
+            sentences = []
+            start = 0
+            for match in SENTENCE_BOUNDARY.finditer(buffer):
+                # Ranh giới ở cuối buffer chưa chắc chắn (khối sau có thể nối tiếp câu)
+                if match.end() == len(buffer):
+                    break
+                sentences.append((start, match.end()))
+                start = match.end()
+            while len(buffer) - start > MAX_SENTENCE_CHARS:
+                sentences.append((start, start + MAX_SENTENCE_CHARS))
+                start += MAX_SENTENCE_CHARS
+            texts = [buffer[s:e] for s, e in sentences]
+            for (s, _), text, spans in zip(sentences, texts, self.token_spans(texts)):
+                yield text, base + s, spans
+            buffer = buffer[start:]
+            base += start
+        if buffer:
+            yield buffer, base, self.token_spans([buffer])[0]
+
+    def _make_chunk(self, sentences: list) -> Chunk:
+        content = "".join(text for text, _, _ in sentences)
+        stripped = content.rstrip()
+        start_offset = sentences[0][1]
+        return Chunk(stripped, start_offset, start_offset + len(stripped), sum(len(spans) for _, _, spans in sentences))
+
+    def _split_long_sentence(self, text: str, start_offset: int, spans: list) -> Iterator[Chunk]:
+        """Cắt câu dài hơn max_tokens thành các đoạn max_tokens token, chồng lấn overlap_tokens"""
+        step = self.max_tokens - self.overlap_tokens
+        for first in range(0, len(spans), step):
+            window = spans[first:first + self.max_tokens]
+            end = window[-1][1] if first + self.max_tokens < len(spans) else len(text.rstrip())
+            begin = window[0][0] if first else 0
+            yield Chunk(text[begin:end], start_offset + begin, start_offset + end, len(window))
+            if first + self.max_tokens >= len(spans):
+                break
+
+    def iter_chunks(self, blocks: Iterable[str]) -> Iterator[Chunk]:
+        """Tách một luồng văn bản (theo trang hoặc đoạn) thành chunk, bộ nhớ giới hạn ở vài câu"""
+        window = []
+        window_tokens = 0
+        has_new = False
+        for sentence in self._iter_sentences(blocks):
+            text, start_offset, spans = sentence
+            num_tokens = len(spans)
+            if not text.strip():
+                # Khoảng trắng giữa các câu vẫn được giữ để nội dung chunk khớp với vị trí ký tự
+                if window:
+                    window.append(sentence)
+                continue
+
+            if num_tokens > self.max_tokens:
+                if has_new:
+                    yield self._make_chunk(window)
+                yield from self._split_long_sentence(text, start_offset, spans)
+                window, window_tokens, has_new = [], 0, False
+                continue
+
+            if window_tokens + num_tokens > self.max_tokens:
+                if has_new:
+                    yield self._make_chunk(window)
+                # Giữ lại các câu cuối làm overlap cho chunk kế tiếp
+                while window and (window_tokens > self.overlap_tokens or window_tokens + num_tokens > self.max_tokens):
+                    window_tokens -= len(window.pop(0)[2])
+                has_new = False
+
+            window.append(sentence)
+            window_tokens += num_tokens
+            has_new = True
+
+        if has_new:
+            yield self._make_chunk(window)
+
+
+@lru_cache(maxsize=None)
+def get_chunker(kind: str = CHUNKER, chunk_size: int = 1000, chunk_overlap: int = 100,
+                max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                model_name: str = EMBEDDING_MODEL):
+    """Chunker dùng chung trong mỗi tiến trình (tokenizer chỉ được tải một lần)"""
+    if kind == "char":
+        return CharChunker(chunk_size, chunk_overlap)
+    if kind == "token":
+        return TokenChunker(max_tokens, overlap_tokens, model_name)
+    raise ValueError(f"Chunker không hợp lệ: {kind} (hỗ trợ: token, char)")
@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import AsyncIterator
+from services.rag import RAGService, DEFAULT_COLLECTION, COLLECTIONS_DIR, collection_dir
+
+# Bộ nhớ tối đa (MB) cho FAISS index (và cache bộ lọc) của các collection đang được tải, tính cả collection mặc định
+# (luôn được giữ); 0 = không giới hạn
+COLLECTIONS_MAX_MEMORY_MB = float(os.getenv("COLLECTIONS_MAX_MEMORY_MB", "1024"))
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class CollectionManager:
+    """Quản lý các collection tài liệu, mỗi collection có database, FAISS index và thư mục upload riêng
+
+    Collection được tải khi có request đầu tiên và dùng chung model embedding. Khi tổng bộ nhớ
+    ước tính của các index vượt max_memory_mb, các collection ít được dùng gần đây nhất bị giải
+    phóng (dữ liệu vẫn nằm trên đĩa và được tải lại ở lần dùng sau). Collection mặc định dùng
+    các file ở thư mục làm việc như trước và không bao giờ bị giải phóng.
+    """
+
+    def __init__(self, default_service: RAGService, max_memory_mb: float = COLLECTIONS_MAX_MEMORY_MB):
+        self.default_service = default_service
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        # {tên: RAGService}, thứ tự theo lần dùng gần nhất
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        # Mỗi collection một khóa để hai request không cùng tải một collection
+        self._load_locks = {}
+        # {RAGService: số request/job đang dùng}, collection bị giải phóng khi đang dùng nằm trong _retired
+        self._users = {}
+        self._retired = set()
+        self.loads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def validate_name(name: str) -> str:
+        if not COLLECTION_NAME_PATTERN.match(name or ""):
+            raise ValueError(f"Tên collection không hợp lệ: {name} (chỉ gồm chữ, số, '_' và '-', tối đa 64 ký tự)")
+        return name
+
+    def exists(self, name: str) -> bool:
+        return name == DEFAULT_COLLECTION or os.path.isdir(collection_dir(name))
+
+    def list_collections(self) -> list:
+        """Tên các collection trên đĩa và collection nào đang được tải"""
+        names = [DEFAULT_COLLECTION]
+        if os.path.isdir(COLLECTIONS_DIR):
+            names += sorted(name for name in os.listdir(COLLECTIONS_DIR)
+                            if COLLECTION_NAME_PATTERN.match(name) and name != DEFAULT_COLLECTION
+                            and os.path.isdir(os.path.join(COLLECTIONS_DIR, name)))
+        with self._lock:
+            loaded = set(self._loaded)
+        return [{"name": name, "loaded": name == DEFAULT_COLLECTION or name in loaded} for name in names]
+
+    def acquire(self, name: str, create: bool = False) -> RAGService:
+        """Lấy RAGService của collection (tải từ đĩa nếu chưa có trong bộ nhớ) và giữ nó đến khi release
+
+        Collection đang được giữ vẫn có thể bị đưa ra khỏi danh sách LRU nhưng chỉ được đóng
+        khi người dùng cuối cùng gọi release.
+        Raises:
+            ValueError: tên không hợp lệ
+            KeyError: collection chưa tồn tại và create=False
+            RuntimeError: tải collection lỗi
+        """
+        if name is None or name == DEFAULT_COLLECTION:
+            return self.default_service
+        self.validate_name(name)
+        with self._lock:
+            service = self._loaded.get(name)
+            if service is not None:
+                self._loaded.move_to_end(name)
+                self._users[service] = self._users.get(service, 0) + 1
+            elif not create and not self.exists(name):
+                raise KeyError(f"Collection không tồn tại: {name}")
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        if service is not None:
+            # Index lớn dần khi thêm file nên giới hạn bộ nhớ được kiểm tra ở mỗi lần dùng
+            self._evict(keep=name)
+            return service
+
+        with load_lock:
+            with self._lock:
+                service = self._loaded.get(name)
+                if service is None:
+                    # Collection bị giải phóng nhưng vẫn đang được dùng: dùng lại thay vì tải bản thứ hai
+                    # (hai bản sẽ dùng chung database và bản cũ đóng kết nối của bản mới)
+                    service = next((retired for retired in self._retired if retired.collection == name), None)
+                    if service is not None:
+                        self._retired.discard(service)
+                        self._loaded[name] = service
+                if service is not None:
+                    self._loaded.move_to_end(name)
+                    self._users[service] = self._users.get(service, 0) + 1
+                    return service
+            service = self._load(name)
+            with self._lock:
+                self._loaded[name] = service
+                self._users[service] = 1
+                self.loads += 1
+            self._evict(keep=name)
+        return service
+
+    def release(self, service: RAGService):
+        """Trả lại collection đã acquire, đóng nó nếu đã bị giải phóng trong lúc được dùng"""
+        if service is self.default_service:
+            return
+        with self._lock:
+            users = self._users.get(service, 0) - 1
+            if users > 0:
+                self._users[service] = users
+                return
+            self._users.pop(service, None)
+            if service not in self._retired:
+                return
+            self._retired.discard(service)
+        service.close()
+
+    @contextmanager
+    def lease(self, name: str, create: bool = False):
+        """acquire/release dùng với câu lệnh with"""
+        service = self.acquire(name, create)
+        try:
+            yield service
+        finally:
+            self.release(service)
+
+    def hold(self, service: RAGService, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Giữ collection trong suốt một luồng trả lời (stream chạy sau khi request handler đã trả về)"""
+        if service is not self.default_service:
+            with self._lock:
+                self._users[service] = self._users.get(service, 0) + 1
+        return self._held(service, chunks)
+
+    async def _held(self, service: RAGService, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        try:
+            async for text in chunks:
+                yield text
+        finally:
+            await chunks.aclose()
+            self.release(service)
+
+    def _load(self, name: str) -> RAGService:
+        print(f"Đang tải collection {name}...")
+        service = RAGService(name)
+        service.warm_up()
+        if service.warmup_error:
+            service.close()
+            raise RuntimeError(f"Không tải được collection {name}: {service.warmup_error}")
+        return service
+
+    def memory_bytes(self) -> dict:
+        """Bộ nhớ ước tính (byte) của index và cache bộ lọc của mỗi collection đang được tải"""
+        with self._lock:
+            services = {DEFAULT_COLLECTION: self.default_service, **self._loaded}
+        return {name: service.memory_bytes() for name, service in services.items()}
+
+    def _evict(self, keep: str):
+        """Giải phóng các collection ít dùng nhất đến khi tổng bộ nhớ không vượt giới hạn"""
+        if self.max_memory_bytes <= 0:
+            return
+        while True:
+            usage = self.memory_bytes()
+            if sum(usage.values()) <= self.max_memory_bytes:
+                return
+            with self._lock:
+                # Không giải phóng collection vừa được tải (dù một mình nó đã vượt giới hạn)
+                victim = next((name for name in self._loaded if name != keep), None)
+                if victim is None:
+                    return
+                service = self._loaded.pop(victim)
+                self.evictions += 1
+                # Collection đang được dùng chỉ được đóng khi người dùng cuối cùng release
+                busy = self._users.get(service, 0) > 0
+                if busy:
+                    self._retired.add(service)
+            print(f"Giải phóng collection {victim} ({usage[victim] / 1024 / 1024:.1f} MB) khỏi bộ nhớ")
+            if not busy:
+                service.close()
+
+    def close(self):
+        """Giải phóng tất cả collection đã tải (trừ collection mặc định)"""
+        with self._lock:
+            services = list(self._loaded.values()) + list(self._retired)
+            self._loaded.clear()
+            self._retired.clear()
+        for service in services:
+            service.close()
+
+    def stats(self) -> dict:
+        usage = self.memory_bytes()
+        return {
+            "max_memory_mb": round(self.max_memory_bytes / 1024 / 1024, 2),
+            "memory_mb": round(sum(usage.values()) / 1024 / 1024, 2),
+            "loaded": {name: round(size / 1024 / 1024, 2) for name, size in usage.items()},
+            "closing": len(self._retired),
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,215 @@
+import os
+import threading
+from typing import Dict, List
+from services.chunker import get_chunker
+
+# Ngân sách token cho context RAG (các chunk tìm được) và cho toàn bộ context trong prompt
+# (RAG, web, file đính kèm), 0 = không giới hạn
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+PROMPT_CONTEXT_MAX_TOKENS = int(os.getenv("PROMPT_CONTEXT_MAX_TOKENS", "6000"))
+# Đoạn bị cắt ngắn hơn số token này thì bỏ hẳn (phần còn lại của ngân sách quá nhỏ để hữu ích)
+MIN_PARTIAL_TOKENS = 32
+# Độ dài tối đa (ký tự) được dò khi tìm phần chồng lấn giữa hai chunk không có vị trí ký tự
+MAX_OVERLAP_CHARS = 2000
+
+
+def _overlap(left: str, right: str) -> int:
+    """Độ dài phần cuối của left trùng với phần đầu của right"""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class ContextAssembler:
+    """Ghép context đưa vào prompt trong giới hạn token
+
+    Các chunk liền kề hoặc chồng lấn của cùng một file được nối thành một đoạn (phần trùng chỉ
+    giữ một lần), các đoạn trùng nội dung bị loại, sau đó các đoạn được xếp theo độ liên quan
+    và đưa vào đến khi hết ngân sách token. Số token bị bỏ được ghi lại trong stats().
+    fit_sources chia ngân sách token của prompt cho các nguồn RAG, web và file đính kèm.
+    """
+
+    def __init__(self, max_tokens: int = CONTEXT_MAX_TOKENS, prompt_max_tokens: int = PROMPT_CONTEXT_MAX_TOKENS):
+        self.max_tokens = max_tokens
+        self.prompt_max_tokens = prompt_max_tokens
+        self._totals = {}
+        self._last = {}
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        # Dùng cùng cách đếm token với chunker (tokenizer của model embedding hoặc regex)
+        return get_chunker("token")
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(spans) for spans in self.tokenizer.token_spans(texts)]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cắt văn bản tại ranh giới token thứ max_tokens"""
+        spans = self.tokenizer.token_spans([text])[0]
+        if len(spans) <= max_tokens:
+            return text
+        return text[:spans[max_tokens - 1][1]] if max_tokens > 0 else ""
+
+    def merge_chunks(self, chunk_ids: list, chunks: Dict[int, dict]) -> List[dict]:
+        """Nối các chunk liền kề/chồng lấn của cùng file
+
+        Args:
+            chunk_ids: id chunk theo độ liên quan giảm dần
+            chunks: {chunk_id: dict(file_id, chunk_index, start_offset, end_offset, token_count, content)}
+        Returns:
+            list: các đoạn dict(content, rank, chunks) với rank là thứ hạng tốt nhất của chunk trong đoạn
+        """
+        by_file = {}
+        for rank, chunk_id in enumerate(chunk_ids):
+            chunk = chunks.get(int(chunk_id))
+            if chunk is not None:
+                by_file.setdefault(chunk["file_id"], []).append((rank, chunk))
+
+        spans = []
+        for items in by_file.values():
+            items.sort(key=lambda item: item[1]["chunk_index"])
+            current = None
+            for rank, chunk in items:
+                if current is not None and self._adjacent(current, chunk):
+                    current["content"] = self._join(current, chunk)
+                    current["end_offset"] = chunk["end_offset"]
+                    current["chunk_index"] = chunk["chunk_index"]
+                    current["rank"] = min(current["rank"], rank)
+                    current["chunks"] += 1
+                    continue
+                if current is not None:
+                    spans.append(current)
+                current = {
+                    "content": chunk["content"],
+                    "start_offset": chunk["start_offset"],
+                    "end_offset": chunk["end_offset"],
+                    "chunk_index": chunk["chunk_index"],
+                    "token_count": chunk["token_count"],
+                    "rank": rank,
+                    "chunks": 1,
+                }
+            spans.append(current)
+        return spans
+
+    def _adjacent(self, current: dict, chunk: dict) -> bool:
+        if chunk["chunk_index"] == current["chunk_index"] + 1:
+            return True
+        # Các chunk không liên tiếp nhưng vẫn chồng lấn theo vị trí ký tự
+        return (current["end_offset"] is not None and chunk["start_offset"] is not None
+                and chunk["start_offset"] < current["end_offset"])
+
+    def _join(self, current: dict, chunk: dict) -> str:
+        """Nối nội dung chunk vào đoạn hiện tại, phần chồng lấn chỉ giữ một lần"""
+        if current["end_offset"] is not None and chunk["start_offset"] is not None:
+            overlap = current["end_offset"] - chunk["start_offset"]
+            if overlap > 0:
+                return current["content"] + chunk["content"][overlap:]
+            return current["content"] + "\n" + chunk["content"]
+        overlap = _overlap(current["content"], chunk["content"])
+        if overlap:
+            return current["content"] + chunk["content"][overlap:]
+        return current["content"] + "\n" + chunk["content"]
+
+    def assemble(self, chunk_ids: list, chunks: Dict[int, dict], max_tokens: int = None) -> str:
+        """Ghép các chunk tìm được (theo độ liên quan giảm dần) thành context không vượt quá max_tokens token"""
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        found = [chunks[chunk_id] for chunk_id in dict.fromkeys(int(chunk_id) for chunk_id in chunk_ids)
+                 if chunk_id in chunks]
+        # Chunk ký tự không lưu số token nên được đếm lại
+        uncounted = [chunk["content"] for chunk in found if chunk["token_count"] is None]
+        input_tokens = sum(chunk["token_count"] for chunk in found if chunk["token_count"] is not None)
+        input_tokens += sum(self.count_tokens(uncounted))
+
+        spans = self.merge_chunks(chunk_ids, chunks)
+        spans.sort(key=lambda span: span["rank"])
+
+        # Loại các đoạn trùng nội dung (ví dụ cùng tài liệu được upload hai lần) hoặc nằm trong đoạn khác
+        unique = []
+        kept_texts = []
+        for span in spans:
+            normalized = " ".join(span["content"].split())
+            if any(normalized in other for other in kept_texts):
+                continue
+            unique.append(span)
+            kept_texts.append(normalized)
+
+        # Đưa các đoạn vào theo độ liên quan, đoạn không vừa ngân sách bị cắt hoặc bỏ
+        selected = []
+        used = 0
+        for span, num_tokens in zip(unique, self.count_tokens([span["content"] for span in unique])):
+            remaining = max_tokens - used if max_tokens > 0 else num_tokens
+            if num_tokens <= remaining:
+                selected.append(span["content"])
+                used += num_tokens
+            elif remaining >= MIN_PARTIAL_TOKENS:
+                selected.append(self.truncate(span["content"], remaining))
+                used += remaining
+
+        self._record("rag", {
+            "input_tokens": input_tokens,
+            "output_tokens": used,
+            "dropped_tokens": max(input_tokens - used, 0),
+            "merged_chunks": len(found) - len(spans),
+            "duplicates": len(spans) - len(unique),
+        })
+        return "\n".join(selected)
+
+    def fit_sources(self, sources: Dict[str, str], max_tokens: int = None) -> Dict[str, str]:
+        """Chia ngân sách token cho các nguồn context (RAG, web, file) của prompt
+
+        Nguồn ngắn được giữ nguyên, phần ngân sách còn lại chia đều cho các nguồn dài hơn
+        và các nguồn này bị cắt tại ranh giới token.
+        """
+        max_tokens = self.prompt_max_tokens if max_tokens is None else max_tokens
+        names = [name for name, text in sources.items() if text]
+        if max_tokens <= 0 or not names:
+            return dict(sources)
+
+        token_counts = dict(zip(names, self.count_tokens([sources[name] for name in names])))
+        total = sum(token_counts.values())
+        fitted = dict(sources)
+        remaining = max_tokens
+        if total > max_tokens:
+            pending = sorted(names, key=lambda name: token_counts[name])
+            while pending:
+                share = remaining // len(pending)
+                name = pending.pop(0)
+                if token_counts[name] > share:
+                    fitted[name] = self.truncate(sources[name], share)
+                    remaining -= share
+                else:
+                    remaining -= token_counts[name]
+            used = max_tokens - remaining
+        else:
+            used = total
+
+        self._record("prompt", {
+            "input_tokens": total,
+            "output_tokens": used,
+            "dropped_tokens": total - used,
+            "merged_chunks": 0,
+            "duplicates": 0,
+        })
+        return fitted
+
+    def _record(self, stage: str, report: dict):
+        with self._lock:
+            totals = self._totals.setdefault(stage, {"calls": 0, **{key: 0 for key in report}})
+            totals["calls"] += 1
+            for key, value in report.items():
+                totals[key] += value
+            self._last[stage] = report
+
+    def stats(self) -> dict:
+        """Với context RAG và context của prompt: tổng số token đầu vào, đưa vào prompt và bị bỏ"""
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "prompt_max_tokens": self.prompt_max_tokens,
+                **{stage: {**totals, "last": self._last[stage]} for stage, totals in self._totals.items()},
+            }
+
+
+context_assembler = ContextAssembler()
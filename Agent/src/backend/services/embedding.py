@@ -0,0 +1,44 @@
+import os
+import threading
+import time
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+_models = {}
+_tokenizers = {}
+_lock = threading.Lock()
+
+def get_embedding_model(model_name: str = EMBEDDING_MODEL):
+    """Trả về SentenceTransformer dùng chung cho cả process, chỉ tải ở lần gọi đầu tiên"""
+    with _lock:
+        if model_name not in _models:
+            # Import sentence_transformers (kéo theo torch) rất chậm, chỉ import khi thực sự cần
+            from sentence_transformers import SentenceTransformer
+            start_time = time.time()
+            _models[model_name] = SentenceTransformer(model_name)
+            print(f"Đã tải model embedding {model_name} trong {time.time() - start_time:.2f}s")
+        return _models[model_name]
+
+def get_tokenizer(model_name: str = EMBEDDING_MODEL):
+    """Trả về tokenizer của model embedding mà không tải trọng số model
+
+    Dùng tokenizer của model đã tải trong process nếu có. Trả về None khi không tải được
+    (ví dụ thiếu thư viện transformers hoặc không có mạng).
+    """
+    with _lock:
+        if model_name in _models:
+            return getattr(_models[model_name], "tokenizer", None)
+        if model_name not in _tokenizers:
+            _tokenizers[model_name] = None
+            try:
+                from transformers import AutoTokenizer
+                # Model của sentence-transformers có thể được gọi bằng tên ngắn
+                for name in (model_name, f"sentence-transformers/{model_name}"):
+                    try:
+                        _tokenizers[model_name] = AutoTokenizer.from_pretrained(name)
+                        break
+                    except (OSError, ValueError):
+                        continue
+            except ImportError:
+                pass
+        return _tokenizers[model_name]
@@ -0,0 +1,163 @@
+import os
+import time
+import faiss
+import numpy as np
+
+# Loại index: flat (tìm kiếm vét cạn), ivf, hnsw, ivfpq (nén vector, tiết kiệm bộ nhớ)
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "256"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_CONSTRUCTION = int(os.getenv("FAISS_EF_CONSTRUCTION", "200"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "16"))
+FAISS_PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+# Số điểm tối thiểu cho mỗi centroid khi train IVF (khuyến nghị của FAISS)
+MIN_POINTS_PER_CENTROID = 39
+
+
+def min_train_vectors(index_type: str) -> int:
+    """Số vector tối thiểu để train index (0 với loại không cần train)"""
+    if index_type == "ivf":
+        return MIN_POINTS_PER_CENTROID
+    if index_type == "ivfpq":
+        return max(MIN_POINTS_PER_CENTROID, 2 ** FAISS_PQ_NBITS)
+    return 0
+
+
+def create_index(index_type: str, dim: int, train_vectors: np.ndarray = None):
+    """Tạo FAISS index theo loại, các vector được thêm bằng add_with_ids (id của chunk)
+
+    IVF và IVF-PQ cần train trên train_vectors; nếu chưa đủ dữ liệu để train,
+    index flat được dùng thay thế.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Loại FAISS index không hợp lệ: {index_type} (hỗ trợ: {', '.join(INDEX_TYPES)})")
+
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M)
+        base.hnsw.efConstruction = FAISS_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(base)
+
+    if index_type in ("ivf", "ivfpq"):
+        num_vectors = 0 if train_vectors is None else len(train_vectors)
+        nlist = min(FAISS_NLIST, num_vectors // MIN_POINTS_PER_CENTROID)
+        if num_vectors < min_train_vectors(index_type):
+            print(f"Chưa đủ {num_vectors} vectors để train index {index_type}, dùng index flat")
+            return create_index("flat", dim)
+
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, FAISS_PQ_M, FAISS_PQ_NBITS)
+        start_time = time.time()
+        index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+        print(f"Đã train index {index_type} (nlist={nlist}) trên {num_vectors} vectors "
+              f"trong {time.time() - start_time:.2f}s")
+        return index
+
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+
+def _base_index(index):
+    """Lấy index bên trong IndexIDMap/IndexIDMap2 (nếu có)"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index) -> str:
+    """Xác định loại của một FAISS index đã tạo"""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def supports_remove(index) -> bool:
+    """HNSW không hỗ trợ xóa vector, cần dựng lại index"""
+    return index_type_of(index) != "hnsw"
+
+
+def index_memory_bytes(index) -> int:
+    """Ước lượng bộ nhớ (byte) của index: vector hoặc mã nén, id và đồ thị HNSW"""
+    if index is None:
+        return 0
+    base = _base_index(index)
+    ntotal = index.ntotal
+    if isinstance(base, faiss.IndexIVFPQ):
+        size = ntotal * (base.code_size + 8) + base.nlist * base.d * 4
+    elif isinstance(base, faiss.IndexIVF):
+        size = ntotal * (base.d * 4 + 8) + base.nlist * base.d * 4
+    else:
+        size = ntotal * (index.d * 4 + 8)
+    if isinstance(base, faiss.IndexHNSW):
+        # Mỗi vector có khoảng 2*M láng giềng ở tầng 0, mỗi láng giềng là một int32
+        size += ntotal * base.hnsw.nb_neighbors(0) * 4
+    return size
+
+
+def apply_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Cấu hình tham số tìm kiếm: nprobe cho IVF, efSearch cho HNSW"""
+    base = _base_index(index)
+    if nprobe is not None and isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(nprobe, base.nlist)
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+
+
+def selector_search_params(index, ids: np.ndarray, nprobe: int = None, ef_search: int = None):
+    """Tham số tìm kiếm chỉ xét các vector có id trong ids (lọc ngay trong lúc tìm kiếm)
+
+    Returns:
+        tuple: (SearchParameters, IDSelectorBatch); selector cần được giữ tham chiếu đến khi tìm kiếm xong
+    """
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=min(nprobe or base.nprobe, base.nlist))
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or base.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return params, selector
+
+
+def recall_at_k(index, exact_index, queries: np.ndarray, k: int) -> dict:
+    """So sánh kết quả của index với index flat (chính xác) trên cùng tập câu truy vấn
+
+    Returns:
+        dict: recall@k trung bình và thời gian tìm kiếm trung bình (ms/truy vấn) của hai index
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+    start_time = time.time()
+    _, exact_ids = exact_index.search(queries, k)
+    exact_ms = (time.time() - start_time) * 1000 / len(queries)
+
+    start_time = time.time()
+    _, approx_ids = index.search(queries, k)
+    approx_ms = (time.time() - start_time) * 1000 / len(queries)
+
+    hits = 0
+    total = 0
+    for exact_row, approx_row in zip(exact_ids, approx_ids):
+        expected = {int(i) for i in exact_row if i != -1}
+        hits += len(expected & {int(i) for i in approx_row if i != -1})
+        total += len(expected)
+
+    return {
+        "index_type": index_type_of(index),
+        "k": k,
+        "num_queries": len(queries),
+        "recall_at_k": round(hits / total, 4) if total else 1.0,
+        "search_ms": round(approx_ms, 3),
+        "flat_search_ms": round(exact_ms, 3),
+    }
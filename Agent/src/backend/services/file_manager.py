@@ -1,30 +1,66 @@
 import os
+import asyncio
+import hashlib
 from fastapi import UploadFile
 import PyPDF2
 from docx import Document
 import yaml
-from typing import List
+import codecs
+from typing import Iterator, List
 
 UPLOAD_FOLDER = "uploaded_files"
+# Định dạng file được đưa vào RAG
+SUPPORTED_EXTENSIONS = ('.txt', '.pdf', '.doc', '.docx', '.yaml', '.yml')
+# Kích thước mỗi khối khi ghi file upload xuống đĩa
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-def save_file(file: UploadFile) -> str:
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    with open(file_path, "wb") as f:
-        f.write(file.file.read())
-    return file_path
+async def save_file(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE, folder: str = UPLOAD_FOLDER) -> dict:
+    """Ghi file upload xuống đĩa theo từng khối, tính SHA-256 trong lúc ghi
 
-def delete_file(file_name: str) -> bool:
-    file_path = os.path.join(UPLOAD_FOLDER, file_name)
+    Nội dung được ghi vào file tạm rồi đổi tên, nên việc đồng bộ thư mục không bao giờ
+    thấy file ghi dở. Việc ghi đĩa chạy trong thread để không chặn event loop.
+    Returns:
+        dict: "path", "size" (bytes) và "file_hash" (SHA-256) của file đã lưu
+    """
+    file_name = os.path.basename(file.filename)
+    file_path = os.path.join(folder, file_name)
+    temp_path = os.path.join(folder, f".{file_name}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, "wb") as f:
+            while True:
+                block = await file.read(chunk_size)
+                if not block:
+                    break
+                digest.update(block)
+                size += len(block)
+                await asyncio.to_thread(f.write, block)
+        os.replace(temp_path, file_path)
+    except Exception as e:
+        print(f"Lỗi khi lưu file {file_name}: {str(e)}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        await file.close()
+    return {"path": file_path, "size": size, "file_hash": digest.hexdigest()}
+
+def delete_file(file_name: str, folder: str = UPLOAD_FOLDER) -> bool:
+    file_path = os.path.join(folder, file_name)
     if os.path.exists(file_path):
         os.remove(file_path)
         return True
     return False
 
-def list_files() -> List[dict]:
+def list_files(folder: str = UPLOAD_FOLDER) -> List[dict]:
     files = []
-    for file_name in os.listdir(UPLOAD_FOLDER):
-        file_path = os.path.join(UPLOAD_FOLDER, file_name)
+    for file_name in os.listdir(folder):
+        # Bỏ qua file tạm của các upload đang ghi
+        if file_name.startswith('.'):
+            continue
+        file_path = os.path.join(folder, file_name)
         size = os.path.getsize(file_path)
         files.append({"name": file_name, "size": size, "path": file_path})
     return files
@@ -42,19 +78,23 @@ def read_file(file_path: str) -> str:
         return read_txt_file(file_path)
 
 def read_pdf(file_path: str) -> str:
+    return "".join(iter_pdf_pages(file_path))
+
+def read_docx(file_path: str) -> str:
+    return "".join(iter_docx_paragraphs(file_path))
+
+def iter_pdf_pages(file_path: str) -> Iterator[str]:
+    """Trích xuất văn bản của PDF theo từng trang, không giữ toàn bộ văn bản trong bộ nhớ"""
     with open(file_path, 'rb') as file:
         pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
         for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+            yield (page.extract_text() or "") + "\n"
 
-def read_docx(file_path: str) -> str:
+def iter_docx_paragraphs(file_path: str) -> Iterator[str]:
+    """Trích xuất văn bản của DOCX theo từng đoạn"""
     doc = Document(file_path)
-    text = ""
     for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
+        yield paragraph.text + "\n"
 
 def read_yaml(file_path: str) -> str:
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -71,6 +111,25 @@ def read_txt_file(file_path: str) -> str:
             continue
     raise Exception(f"Không thể đọc file với các encoding đã thử")
 
+def detect_txt_encoding(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Chọn encoding giống read_txt_file nhưng kiểm tra file theo từng khối"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                decoder.decode(block)
+        decoder.decode(b'', final=True)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        # latin1 giải mã được mọi chuỗi byte
+        return 'latin1'
+
+def iter_txt_file(file_path: str, block_size: int = 1024 * 1024) -> Iterator[str]:
+    """Đọc file text theo từng khối ký tự"""
+    with open(file_path, 'r', encoding=detect_txt_encoding(file_path)) as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            yield block
+
 async def read_uploaded_file(file: UploadFile) -> str:
     """Đọc nội dung file được gửi trực tiếp từ frontend dựa trên định dạng."""
     file_name = file.filename
@@ -78,42 +137,36 @@ async def read_uploaded_file(file: UploadFile) -> str:
     
     try:
         if file_name.endswith('.pdf'):
-            content = await read_pdf(file)
+            content = await read_uploaded_pdf(file)
         elif file_name.endswith(('.doc', '.docx')):
-            content = await read_docx(file)
+            content = await read_uploaded_docx(file)
         elif file_name.endswith(('.yaml', '.yml')):
-            content = await read_yaml(file)
+            content = await read_uploaded_yaml(file)
         else:
-            content = await read_txt_file(file)
+            content = await read_uploaded_txt_file(file)
         return content
     except Exception as e:
         raise Exception(f"Không thể đọc file {file_name}: {str(e)}")
     finally:
         await file.close()  # Đóng file sau khi đọc
 
-async def read_pdf(file: UploadFile) -> str:
+async def read_uploaded_pdf(file: UploadFile) -> str:
     """Đọc nội dung file PDF từ UploadFile."""
     pdf_reader = PyPDF2.PdfReader(file.file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    return "".join(page.extract_text() + "\n" for page in pdf_reader.pages)
 
-async def read_docx(file: UploadFile) -> str:
+async def read_uploaded_docx(file: UploadFile) -> str:
     """Đọc nội dung file DOCX từ UploadFile."""
     doc = Document(file.file)
-    text = ""
-    for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
+    return "".join(paragraph.text + "\n" for paragraph in doc.paragraphs)
 
-async def read_yaml(file: UploadFile) -> str:
+async def read_uploaded_yaml(file: UploadFile) -> str:
     """Đọc nội dung file YAML từ UploadFile."""
     content = await file.read()
     data = yaml.safe_load(content)
     return str(data)
 
-async def read_txt_file(file: UploadFile) -> str:
+async def read_uploaded_txt_file(file: UploadFile) -> str:
     """Đọc nội dung file text từ UploadFile."""
     content = await file.read()
     encodings = ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']
@@ -0,0 +1,18 @@
+from typing import Hashable, List, Sequence
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], weights: Sequence[float] = None,
+                           rrf_k: int = 60) -> List[Hashable]:
+    """Gộp nhiều danh sách kết quả đã xếp hạng bằng reciprocal-rank fusion (RRF)
+
+    Mỗi phần tử nhận điểm sum(weight / (rrf_k + rank)) trên các danh sách chứa nó (rank bắt đầu
+    từ 1), nên chỉ thứ hạng được dùng và không cần chuẩn hóa điểm của BM25 hay khoảng cách L2.
+    Returns:
+        list: các phần tử theo điểm RRF giảm dần
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,8 +1,16 @@
-from models.llm import LLM
+from models.llm import get_llm
+from services.timing import stage_timings
 
 class GeneratorService:
-    def __init__(self):
-        self.llm = LLM()
+    @property
+    def llm(self):
+        # LLM được khởi tạo ở request đầu tiên thay vì lúc import route
+        return get_llm()
 
     async def generate_content(self, prompt, rag_response: str = None, web_response: str = None, file_response: str = None) -> str:
-        return await self.llm.generateContent(prompt, rag_response, web_response, file_response)
\ No newline at end of file
+        with stage_timings.measure("total", self.llm.analysis_mode):
+            return await self.llm.generateContent(prompt, rag_response, web_response, file_response)
+
+    def generate_content_stream(self, prompt, rag_response: str = None, web_response: str = None, file_response: str = None):
+        """Async generator trả về từng đoạn nội dung ngay khi LLM sinh ra"""
+        return self.llm.generateContentStream(prompt, rag_response, web_response, file_response)
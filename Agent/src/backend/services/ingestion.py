@@ -0,0 +1,118 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from services.timing import stage_timings
+
+# Số job đã xong được giữ lại để tra trạng thái
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", "1000"))
+# Thời gian tối đa (giây) worker chờ RAG khởi động xong trước khi báo lỗi job
+INGESTION_READY_TIMEOUT = float(os.getenv("INGESTION_READY_TIMEOUT", "600"))
+
+
+class IngestionQueue:
+    """Hàng đợi ingestion chạy nền: parse → chunk → embed → index từng file đã upload
+
+    Mỗi job thuộc một collection, RAGService của collection được lấy qua collections khi job
+    chạy (collection có thể đã bị giải phóng khỏi bộ nhớ trong lúc job chờ). Một worker thread
+    xử lý lần lượt các job để việc cập nhật index không chạy trong request HTTP. Trạng thái của
+    mỗi job (queued, running, done, unchanged, failed) cùng thời gian từng bước được giữ trong
+    bộ nhớ; thời gian các bước cũng được ghi vào stage_timings.
+    """
+
+    def __init__(self, collections, history: int = INGESTION_JOB_HISTORY,
+                 ready_timeout: float = INGESTION_READY_TIMEOUT):
+        self.collections = collections
+        self.history = history
+        self.ready_timeout = ready_timeout
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, file_path: str, file_hash: str = None, collection: str = None) -> dict:
+        """Thêm file vào hàng đợi của collection (None = collection mặc định), trả về thông tin job"""
+        job = {
+            "id": uuid.uuid4().hex,
+            "file_name": os.path.basename(file_path),
+            "collection": collection,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "stages": {},
+            "added": 0,
+            "removed": 0,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._trim()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="ingestion", daemon=True)
+                self._worker.start()
+        self._queue.put((job["id"], file_path, file_hash, collection))
+        return dict(job)
+
+    def get(self, job_id: str):
+        """Trạng thái của job, None nếu không tồn tại (hoặc đã bị xóa khỏi lịch sử)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _trim(self):
+        # Chỉ xóa các job đã xong, job đang chờ hoặc đang chạy luôn được giữ
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _wait_until_ready(self, rag_service):
+        deadline = time.time() + self.ready_timeout
+        while not rag_service.ready:
+            if rag_service.warmup_error:
+                raise RuntimeError(f"RAG khởi động lỗi: {rag_service.warmup_error}")
+            if time.time() > deadline:
+                raise TimeoutError("RAG chưa sẵn sàng")
+            time.sleep(0.1)
+
+    def _run(self):
+        while True:
+            job_id, file_path, file_hash, collection = self._queue.get()
+            try:
+                self._process(job_id, file_path, file_hash, collection)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job_id: str, file_path: str, file_hash: str, collection: str):
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            with self.collections.lease(collection) as rag_service:
+                self._wait_until_ready(rag_service)
+                result = rag_service.ingest_file(file_path, file_hash=file_hash)
+            for stage, seconds in result["stages"].items():
+                stage_timings.record(stage, seconds * 1000, "ingestion")
+            self._update(job_id, status="done" if result["changed"] else "unchanged", stages=result["stages"],
+                         added=result["added"], removed=result["removed"])
+        except Exception as e:
+            print(f"Lỗi khi ingest file {file_path}: {str(e)}")
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            self._update(job_id, finished_at=time.time())
+
+    def stats(self) -> dict:
+        """Số job đang chờ trong hàng đợi, số job theo trạng thái và thời gian các bước"""
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+        return {
+            "queue_depth": self._queue.qsize(),
+            "jobs": statuses,
+            "stages": stage_timings.stats().get("ingestion", {}),
+        }
@@ -0,0 +1,204 @@
+import os
+import re
+import time
+import threading
+from services.vector_db import ConnectionPool
+
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", "page_cache.db")
+# Tổng dung lượng văn bản được lưu, vượt quá thì xóa các trang ít được dùng nhất
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+# Trong khoảng thời gian này (giây) trang được trả về từ cache mà không hỏi lại server
+PAGE_CACHE_FRESH_SECONDS = float(os.getenv("PAGE_CACHE_FRESH_SECONDS", "300"))
+# auto: selectolax nếu có, rồi lxml, cuối cùng là html.parser của BeautifulSoup
+HTML_PARSER = os.getenv("HTML_PARSER", "auto").lower()
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+SKIPPED_TAGS = ("script", "style")
+WHITESPACE = re.compile(r"\s+")
+
+
+def _parser_backend() -> str:
+    if HTML_PARSER in ("auto", "selectolax") and HTMLParser is not None:
+        return "selectolax"
+    if HTML_PARSER in ("auto", "selectolax", "lxml") and lxml is not None:
+        return "lxml"
+    return "html.parser"
+
+
+PARSER_BACKEND = _parser_backend()
+
+
+def extract_text(html: str) -> str:
+    """Lấy văn bản của trang HTML (bỏ script, style), các khoảng trắng liên tiếp được gộp trong một lần quét"""
+    if not html.strip():
+        return ""
+    if PARSER_BACKEND == "selectolax":
+        tree = HTMLParser(html)
+        tree.strip_tags(list(SKIPPED_TAGS))
+        text = tree.root.text() if tree.root is not None else ""
+    elif PARSER_BACKEND == "lxml":
+        try:
+            document = lxml.html.fromstring(html)
+            etree.strip_elements(document, *SKIPPED_TAGS, with_tail=False)
+            text = document.text_content()
+        except (ValueError, etree.LxmlError):
+            # Trang XHTML có khai báo <?xml ... encoding=...?> (lxml không nhận chuỗi unicode kèm
+            # encoding) hoặc trang chỉ có comment ("Document is empty")
+            text = _soup_text(html)
+    else:
+        text = _soup_text(html)
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def _soup_text(html: str) -> str:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(list(SKIPPED_TAGS)):
+        script.decompose()
+    return soup.get_text()
+
+
+class PageCache:
+    """Cache văn bản đã trích xuất của các trang web, lưu trong SQLite theo URL
+
+    Mỗi trang lưu kèm ETag/Last-Modified để hỏi lại server bằng request có điều kiện
+    (304 Not Modified thì dùng lại văn bản cũ). Khi tổng dung lượng vượt max_bytes,
+    các trang ít được dùng nhất bị xóa.
+    """
+
+    def __init__(self, db_path: str = PAGE_CACHE_PATH, max_bytes: int = PAGE_CACHE_MAX_BYTES,
+                 fresh_seconds: float = PAGE_CACHE_FRESH_SECONDS):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.pool = ConnectionPool(db_path, size=4)
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self.init_db()
+
+    def init_db(self):
+        """Khởi tạo bảng cache"""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS pages (
+                        url TEXT PRIMARY KEY,
+                        etag TEXT,
+                        last_modified TEXT,
+                        content TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        fetched_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                ''')
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_last_used ON pages (last_used)")
+        except Exception as e:
+            print(f"Lỗi khi khởi tạo page cache: {str(e)}")
+            raise
+
+    def get(self, url: str):
+        """Trả về dict (content, etag, last_modified, fresh) của trang đã cache hoặc None"""
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT content, etag, last_modified, fetched_at FROM pages WHERE url = ?",
+                                   (url,)).fetchone()
+            if row is None:
+                return None
+            content, etag, last_modified, fetched_at = row
+            return {
+                "content": content,
+                "etag": etag,
+                "last_modified": last_modified,
+                "fresh": time.time() - fetched_at < self.fresh_seconds,
+            }
+        except Exception as e:
+            # Lỗi cache không được làm hỏng việc tải trang
+            print(f"Lỗi khi đọc page cache: {str(e)}")
+            return None
+
+    def touch(self, url: str, revalidated: bool = False):
+        """Đánh dấu trang vừa được dùng; revalidated=True khi server trả 304 (trang lại được coi là mới)"""
+        now = time.time()
+        try:
+            with self.pool.connection() as conn:
+                if revalidated:
+                    conn.execute("UPDATE pages SET last_used = ?, fetched_at = ? WHERE url = ?", (now, now, url))
+                else:
+                    conn.execute("UPDATE pages SET last_used = ? WHERE url = ?", (now, url))
+        except Exception as e:
+            print(f"Lỗi khi ghi page cache: {str(e)}")
+
+    def set(self, url: str, content: str, etag: str = None, last_modified: str = None):
+        """Lưu văn bản của trang, xóa các trang ít dùng nhất khi vượt max_bytes"""
+        now = time.time()
+        size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO pages (url, etag, last_modified, content, size, fetched_at, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (url, etag, last_modified, content, size, now, now))
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = []
+                    for old_url, old_size in conn.execute("SELECT url, size FROM pages ORDER BY last_used"):
+                        if total <= self.max_bytes:
+                            break
+                        evicted.append((old_url,))
+                        total -= old_size
+                    conn.executemany("DELETE FROM pages WHERE url = ?", evicted)
+        except Exception as e:
+            print(f"Lỗi khi ghi page cache: {str(e)}")
+
+    def clear(self):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM pages")
+
+    def count(self, name: str):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> dict:
+        """Số lần dùng cache (trực tiếp, sau khi hỏi lại server), số lần tải mới và dung lượng"""
+        with self.pool.connection() as conn:
+            pages, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "pages": pages,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "fresh_seconds": self.fresh_seconds,
+            "parser": PARSER_BACKEND,
+        }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_page_cache():
+    """Trả về PageCache dùng chung, None nếu cache bị tắt"""
+    global _shared_cache
+    if not PAGE_CACHE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = PageCache()
+        return _shared_cache
@@ -1,31 +1,224 @@
 import os
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from services.vector_db import VectorDB
-from models.llm import LLM
+from services.vector_db import VectorDB, RetrievalFilters
+from services.file_manager import SUPPORTED_EXTENSIONS
+from services.watcher import FOLDER_WATCH_ENABLED, FolderWatcher
+from services.embedding import EMBEDDING_MODEL, get_embedding_model
+from services.faiss_index import (
+    FAISS_INDEX_TYPE, FAISS_NPROBE, FAISS_EF_SEARCH,
+    create_index, index_type_of, supports_remove, apply_search_params, recall_at_k, selector_search_params,
+    index_memory_bytes, min_train_vectors
+)
+from models.llm import get_llm
 import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from services.batcher import MicroBatcher
+from services.cache import TTLCache
+from services.fusion import reciprocal_rank_fusion
+from services.reranker import RERANK_ENABLED, Reranker
+from services.timing import stage_timings
+from services.response_cache import get_response_cache
+from services.context import context_assembler
 
 FAISS_INDEX_PATH = "faiss_index.bin"
+# File mapping cũ (trước khi index dùng id của chunk), chỉ dùng để chuyển đổi index cũ
 CHUNK_MAPPING_PATH = "chunk_mapping.npy"
 LAST_CHECK_FILE = "last_check.txt"
+DB_FILE = "vector_store.db"
+UPLOAD_DIR = "uploaded_files"
+# Collection mặc định dùng các file ở thư mục làm việc như trước, các collection khác nằm trong COLLECTIONS_DIR/<tên>
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_DIR = os.getenv("COLLECTIONS_DIR", "collections")
+# Mở FAISS index dạng memory-mapped thay vì đọc toàn bộ vào RAM
+FAISS_MMAP = os.getenv("FAISS_MMAP", "true").lower() == "true"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MULTI_PROCESS = os.getenv("EMBED_MULTI_PROCESS", "false").lower() == "true"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_BATCH_SIZE = int(os.getenv("RETRIEVAL_BATCH_SIZE", "32"))
+RETRIEVAL_MAX_WAIT_MS = float(os.getenv("RETRIEVAL_MAX_WAIT_MS", "5"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", str(os.cpu_count() or 1)))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+# vector: chỉ FAISS; bm25: chỉ FTS5; hybrid: gộp hai kết quả bằng reciprocal-rank fusion
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+HYBRID_VECTOR_K = int(os.getenv("HYBRID_VECTOR_K", "20"))
+HYBRID_BM25_K = int(os.getenv("HYBRID_BM25_K", "20"))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_BM25_WEIGHT = float(os.getenv("HYBRID_BM25_WEIGHT", "1.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Tìm kiếm có bộ lọc: tập chunk nhỏ hơn ngưỡng này được so sánh vét cạn với embedding đã lưu,
+# lớn hơn thì tìm trên FAISS index với IDSelectorBatch
+FILTER_BRUTE_FORCE_MAX = int(os.getenv("FILTER_BRUTE_FORCE_MAX", "5000"))
+FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "256"))
+# Tổng dung lượng tối đa (MB) của id và embedding được giữ trong cache bộ lọc (tính vào bộ nhớ của collection)
+FILTER_CACHE_MAX_MB = float(os.getenv("FILTER_CACHE_MAX_MB", "64"))
+
+def collection_dir(collection: str) -> str:
+    """Thư mục chứa database, FAISS index và file upload của collection"""
+    return "" if collection == DEFAULT_COLLECTION else os.path.join(COLLECTIONS_DIR, collection)
+
+def _candidates_nbytes(candidates: tuple) -> int:
+    chunk_ids, vectors = candidates
+    return chunk_ids.nbytes + (vectors.nbytes if vectors is not None else 0)
 
 class RAGService:
-    def __init__(self):
-        self.uploaded_files_dir = "uploaded_files"
-        self.vector_db = VectorDB()
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, collection: str = DEFAULT_COLLECTION):
+        # Mỗi collection có database, FAISS index và thư mục upload riêng, model embedding dùng chung
+        self.collection = collection
+        base_dir = collection_dir(collection)
+        self.uploaded_files_dir = os.path.join(base_dir, UPLOAD_DIR)
+        os.makedirs(self.uploaded_files_dir, exist_ok=True)
+        self.index_path = os.path.join(base_dir, FAISS_INDEX_PATH)
+        self.chunk_mapping_path = os.path.join(base_dir, CHUNK_MAPPING_PATH)
+        self.last_check_file = os.path.join(base_dir, LAST_CHECK_FILE)
+        self.vector_db = VectorDB(os.path.join(base_dir, DB_FILE), self.uploaded_files_dir)
+        self.model_name = EMBEDDING_MODEL
         self.index = None
-        self.llm = LLM()
-        self.chunk_id_mapping = []
-        self.load_or_create_index()  # Chỉ tải hoặc tạo index, không index lại files
+        # Index đang được mở dạng memory-mapped (chỉ đọc), cần tải đầy đủ trước khi sửa
+        self.index_mmapped = False
+        self.index_type = FAISS_INDEX_TYPE
+        self.nprobe = FAISS_NPROBE
+        self.ef_search = FAISS_EF_SEARCH
+        self.embed_batch_size = EMBED_BATCH_SIZE
+        self.embed_multi_process = EMBED_MULTI_PROCESS
+        self.last_index_stats = {}
+        # Báo cáo lần đồng bộ file gần nhất (kết quả và lỗi theo từng file)
+        self.last_sync_report = {}
+        # Khóa bảo vệ FAISS index khi tìm kiếm (trong thread pool) song song với cập nhật index
+        self.index_lock = threading.RLock()
+        # Khóa tuần tự hóa việc cập nhật file (đồng bộ thư mục, upload, xóa file)
+        self.update_lock = threading.RLock()
+        # Tăng mỗi khi index thay đổi; kết quả tìm kiếm được cache theo phiên bản index
+        self.index_version = 0
+        self.query_embedding_cache = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+        self.retrieval_cache = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+        # Id (và embedding nếu tập nhỏ) của các chunk thỏa bộ lọc, theo phiên bản index
+        self.filter_cache = TTLCache(FILTER_CACHE_SIZE, RETRIEVAL_CACHE_TTL, int(FILTER_CACHE_MAX_MB * 1024 * 1024),
+                                     sizeof=_candidates_nbytes)
+        self.filter_brute_force_max = FILTER_BRUTE_FORCE_MAX
+        self.top_k = RETRIEVAL_TOP_K
+        if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+            raise ValueError(f"RETRIEVAL_MODE không hợp lệ: {RETRIEVAL_MODE} (hỗ trợ: {', '.join(RETRIEVAL_MODES)})")
+        self.retrieval_mode = RETRIEVAL_MODE
+        self.hybrid_vector_k = HYBRID_VECTOR_K
+        self.hybrid_bm25_k = HYBRID_BM25_K
+        self.hybrid_vector_weight = HYBRID_VECTOR_WEIGHT
+        self.hybrid_bm25_weight = HYBRID_BM25_WEIGHT
+        self.rrf_k = RRF_K
+        # Bước rerank bằng cross-encoder (tùy chọn): lấy nhiều ứng viên, giữ lại ít chunk tốt hơn
+        self.reranker = Reranker() if RERANK_ENABLED else None
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        self.retrieval_batcher = MicroBatcher(
+            self.retrieve_contexts,
+            self.retrieval_executor,
+            max_batch_size=RETRIEVAL_BATCH_SIZE,
+            max_wait_ms=RETRIEVAL_MAX_WAIT_MS,
+            max_concurrency=RETRIEVAL_WORKERS,
+        )
+        # Model và index được tải trong warm_up (chạy nền khi server khởi động)
+        self.ready = False
+        self.warmup_error = None
+        self._warmup_thread = None
+        # Theo dõi uploaded_files và cập nhật index theo từng sự kiện thêm/sửa/xóa file
+        self.watcher = None
         self.last_check_time = self.load_last_check_time()
 
+    @property
+    def model(self):
+        """Model embedding dùng chung, chỉ tải ở lần dùng đầu tiên"""
+        return get_embedding_model(self.model_name)
+
+    @property
+    def llm(self):
+        return get_llm()
+
+    def warm_up(self):
+        """Tải model embedding và FAISS index, sau đó đồng bộ các file thay đổi trong lúc server tắt"""
+        try:
+            start_time = time.time()
+            self.model.get_sentence_embedding_dimension()
+            if self.reranker is not None:
+                self.reranker.model
+            if self.index is None:
+                # Chunk chưa có embedding (database cũ, lỗi giữa lúc parse và mã hóa) được mã hóa trước
+                embedded = self.embed_missing_chunks()
+                index_existed = os.path.exists(self.index_path)
+                self.load_or_create_index()
+                if embedded and index_existed:
+                    # Index trên đĩa chưa có vector của các chunk vừa mã hóa
+                    self.rebuild_index_from_db()
+            self.ready = True
+            print(f"RAG đã sẵn sàng sau {time.time() - start_time:.2f}s")
+            # Bật watcher trước khi đồng bộ để không bỏ sót thay đổi xảy ra trong lúc đồng bộ
+            if FOLDER_WATCH_ENABLED:
+                self.start_watcher()
+            self.check_and_update_files()
+        except Exception as e:
+            self.warmup_error = str(e)
+            print(f"Lỗi khi khởi động RAG: {str(e)}")
+
+    def start_warm_up(self):
+        """Chạy warm_up trong thread nền để server nhận request ngay lập tức"""
+        if self._warmup_thread is None:
+            self._warmup_thread = threading.Thread(target=self.warm_up, name="rag-warmup", daemon=True)
+            self._warmup_thread.start()
+
+    def start_watcher(self):
+        """Bắt đầu theo dõi thư mục uploaded_files (watchdog hoặc quét định kỳ)"""
+        if self.watcher is None:
+            self.watcher = FolderWatcher(self.uploaded_files_dir, self.apply_file_changes, SUPPORTED_EXTENSIONS)
+            self.watcher.start()
+
+    def stop_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def memory_bytes(self) -> int:
+        """Bộ nhớ ước tính (byte) của FAISS index và các embedding trong cache bộ lọc"""
+        return index_memory_bytes(self.index) + self.filter_cache.nbytes
+
+    def close(self):
+        """Giải phóng index, thread tìm kiếm và kết nối database (khi collection bị đưa ra khỏi bộ nhớ)"""
+        # Dừng watcher trước khi lấy update_lock: thread flush của watcher có thể đang chờ khóa này
+        # trong apply_file_changes, join nó trong lúc giữ khóa sẽ làm hai thread chờ nhau mãi
+        self.stop_watcher()
+        with self.update_lock:
+            with self.index_lock:
+                self.ready = False
+                self.index = None
+                self.index_mmapped = False
+            self.retrieval_batcher.close()
+            self.retrieval_executor.shutdown(wait=False)
+            self.retrieval_cache.clear()
+            self.filter_cache.clear()
+            VectorDB.release(self.vector_db.db_path)
+
+    def apply_file_changes(self, changed_paths: list, deleted_names: list):
+        """Cập nhật index cho đúng các file được báo thay đổi, không quét lại cả thư mục"""
+        with self.update_lock:
+            for file_name in deleted_names:
+                self.remove_file(file_name, save=False)
+            report = self.update_files(changed_paths, save=False) if changed_paths else {}
+            if deleted_names or report.get("changed"):
+                self._ensure_index_type()
+                self.save_index()
+                self._invalidate_responses()
+        if changed_paths or deleted_names:
+            print(f"Đã cập nhật index theo thay đổi thư mục: {len(changed_paths)} file thêm/sửa, "
+                  f"{len(deleted_names)} file xóa")
+
     def load_last_check_time(self):
         """Tải thời gian kiểm tra cuối cùng"""
         try:
-            if os.path.exists(LAST_CHECK_FILE):
-                with open(LAST_CHECK_FILE, 'r') as f:
+            if os.path.exists(self.last_check_file):
+                with open(self.last_check_file, 'r') as f:
                     return float(f.read().strip())
             return 0
         except Exception as e:
@@ -35,13 +228,17 @@ class RAGService:
     def save_last_check_time(self):
         """Lưu thời gian kiểm tra hiện tại"""
         try:
-            with open(LAST_CHECK_FILE, 'w') as f:
+            with open(self.last_check_file, 'w') as f:
                 f.write(str(time.time()))
         except Exception as e:
             print(f"Lỗi khi lưu thời gian kiểm tra: {str(e)}")
 
     def check_and_update_files(self):
         """Kiểm tra và cập nhật database nếu có thay đổi thực sự trong thư mục uploaded_files"""
+        with self.update_lock:
+            return self._check_and_update_files()
+
+    def _check_and_update_files(self):
         try:
             current_time = time.time()
             should_reindex = False
@@ -49,18 +246,19 @@ class RAGService:
             files = os.listdir(self.uploaded_files_dir)
             db_files = self.vector_db.get_all_files()
             db_file_names = {file[1] for file in db_files}
-            db_file_dict = {file[1]: file[4] for file in db_files}
             
             uploaded_files_info = {}
             for file_name in files:
                 file_path = os.path.join(self.uploaded_files_dir, file_name)
-                if file_name.endswith(('.txt', '.pdf', '.doc', '.docx', '.yaml', '.yml')):
+                if file_name.endswith(SUPPORTED_EXTENSIONS):
                     mtime = os.path.getmtime(file_path)
                     uploaded_files_info[file_name] = mtime
             
+            # File được chia chunk theo cấu hình cũ cũng cần xử lý lại
+            stale_files = self.vector_db.get_stale_files()
             new_or_modified_files = []
             for file_name, mtime in uploaded_files_info.items():
-                if file_name not in db_file_names or mtime > self.last_check_time:
+                if file_name not in db_file_names or mtime > self.last_check_time or file_name in stale_files:
                     new_or_modified_files.append(file_name)
                     should_reindex = True
             
@@ -76,16 +274,16 @@ class RAGService:
                     print(f"File đã xóa: {deleted_files}")
                 
                 for file_name in deleted_files:
-                    self.vector_db.delete_file_data(file_name)
+                    self.remove_file(file_name, save=False)
                 
-                for file_name in new_or_modified_files:
-                    file_path = os.path.join(self.uploaded_files_dir, file_name)
-                    try:
-                        self.vector_db.process_file(file_path)
-                    except Exception as e:
-                        print(f"Lỗi khi xử lý file {file_name}: {str(e)}")
+                self.update_files(
+                    [os.path.join(self.uploaded_files_dir, file_name) for file_name in sorted(new_or_modified_files)],
+                    save=False
+                )
                 
-                self.index_files()
+                self._ensure_index_type()
+                self.save_index()
+                self._invalidate_responses()
                 self.save_last_check_time()
                 self.last_check_time = current_time
                 return True
@@ -96,104 +294,593 @@ class RAGService:
             print(f"Lỗi khi kiểm tra và cập nhật files: {str(e)}")
             return False
 
+    def _create_empty_index(self, train_vectors: np.ndarray = None):
+        """Tạo FAISS index rỗng theo loại đã cấu hình, vector được gắn với id của chunk trong VectorDB"""
+        index = create_index(self.index_type, self.model.get_sentence_embedding_dimension(), train_vectors)
+        apply_search_params(index, self.nprobe, self.ef_search)
+        return index
+
     def load_or_create_index(self):
-        """Tải hoặc tạo mới FAISS index và chunk mapping"""
+        """Tải hoặc tạo mới FAISS index"""
         try:
-            if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(CHUNK_MAPPING_PATH):
-                self.index = faiss.read_index(FAISS_INDEX_PATH)
-                self.chunk_id_mapping = np.load(CHUNK_MAPPING_PATH).tolist()
-                print("Đã tải FAISS index và chunk mapping")
+            if os.path.exists(self.index_path):
+                self.index = self._read_index()
+                if os.path.exists(self.chunk_mapping_path):
+                    self._convert_legacy_index()
+                print("Đã tải FAISS index")
+                self._ensure_index_type()
+                apply_search_params(self.index, self.nprobe, self.ef_search)
             else:
-                # Tạo index mới với kích thước vector phù hợp
-                vector_size = self.model.get_sentence_embedding_dimension()
-                self.index = faiss.IndexFlatL2(vector_size)
-                self.chunk_id_mapping = []
-                print("Đã tạo FAISS index mới")
+                # Dựng lại index từ các embedding đã lưu trong database, không cần mã hóa lại
+                self.rebuild_index_from_db()
         except Exception as e:
             print(f"Lỗi khi tải/tạo FAISS index: {str(e)}")
             raise
 
-    def index_files(self):
-        """Index tất cả các file trong thư mục uploaded_files"""
+    def _ensure_index_type(self):
+        """Dựng lại index từ embedding đã lưu khi loại index khác với cấu hình
+
+        Index flat được dùng thay IVF/IVF-PQ khi chưa đủ vector để train; index được dựng lại
+        theo loại đã cấu hình ngay khi số vector đạt ngưỡng train.
+        """
+        current = index_type_of(self.index)
+        if current == self.index_type:
+            return
+        if current == "flat" and self.index.ntotal < min_train_vectors(self.index_type):
+            return
+        print(f"Dựng lại FAISS index {current} thành {self.index_type} ({self.index.ntotal} vectors)")
+        self.rebuild_index_from_db()
+
+    def _read_index(self):
+        """Đọc FAISS index từ đĩa, ưu tiên memory-mapped để không phải đọc toàn bộ vào RAM"""
+        if FAISS_MMAP:
+            try:
+                index = faiss.read_index(self.index_path, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP))
+                self.index_mmapped = True
+                return index
+            except Exception as e:
+                print(f"Không mở được FAISS index dạng memory-mapped, đọc toàn bộ: {str(e)}")
+        self.index_mmapped = False
+        return faiss.read_index(self.index_path)
+
+    def _ensure_writable_index(self):
+        """Index memory-mapped chỉ đọc được, tải đầy đủ vào RAM trước lần sửa đầu tiên"""
+        if self.index_mmapped:
+            index = faiss.read_index(self.index_path)
+            apply_search_params(index, self.nprobe, self.ef_search)
+            self.index = index
+            self.index_mmapped = False
+
+    def _convert_legacy_index(self):
+        """Chuyển index cũ (vị trí vector + chunk_mapping.npy) sang index gắn theo id của chunk"""
+        legacy_index = self.index
+        self.index = self._create_empty_index()
+        self.index_mmapped = False
+        if os.path.exists(self.chunk_mapping_path) and legacy_index.ntotal > 0:
+            chunk_ids = np.load(self.chunk_mapping_path).astype(np.int64)
+            vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+            self.index.add_with_ids(vectors, chunk_ids)
+            # Lưu cả vào database để các lần dựng lại index từ embedding không làm mất các vector này
+            self.vector_db.save_embeddings(chunk_ids.tolist(), vectors, self.model_name)
+        self.save_index()
+        if os.path.exists(self.chunk_mapping_path):
+            os.remove(self.chunk_mapping_path)
+        print("Đã chuyển FAISS index cũ sang dạng gắn theo id của chunk")
+
+    def _bump_index_version(self):
+        """Đánh dấu index đã thay đổi, xóa cache kết quả tìm kiếm"""
+        self.index_version += 1
+        self.retrieval_cache.clear()
+        self.filter_cache.clear()
+
+    def _invalidate_responses(self):
+        """Xóa các câu trả lời đã cache dựa trên tài liệu của collection
+
+        Gọi một lần sau mỗi lần cập nhật file hoặc đồng bộ, ngoài index_lock (ghi SQLite); với
+        save=False, người gọi (đồng bộ thư mục) tự lưu index và gọi hàm này.
+        """
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            response_cache.invalidate_documents(self.collection)
+
+    def save_index(self):
+        """Lưu FAISS index xuống đĩa"""
+        with self.index_lock:
+            # Ghi ra file tạm rồi thay thế, không ghi đè lên file đang được memory-map
+            faiss.write_index(self.index, self.index_path + ".tmp")
+            os.replace(self.index_path + ".tmp", self.index_path)
+
+    def rebuild_index_from_db(self):
+        """Dựng lại FAISS index từ các embedding đã lưu trong VectorDB"""
+        start_time = time.time()
+        chunk_ids, vectors = self.vector_db.get_embeddings(self.model_name)
+        # IVF/IVF-PQ được train trên chính các embedding đã lưu
+        index = self._create_empty_index(vectors)
+        if vectors is not None:
+            index.add_with_ids(vectors, chunk_ids)
+        with self.index_lock:
+            self.index = index
+            self.index_mmapped = False
+            self._bump_index_version()
+        self.save_index()
+        print(f"Đã dựng FAISS index từ {len(chunk_ids)} embeddings đã lưu trong {time.time() - start_time:.2f}s")
+
+    def add_chunks(self, chunk_ids: list, contents: list, batch_size: int = None, timings: dict = None,
+                   pool=None):
+        """Mã hóa, lưu embedding vào database và thêm các chunk vào FAISS index theo id của chunk
+
+        timings (nếu có) được cộng thêm thời gian (giây) của bước "embed" và "index". Với pool
+        (multi-process của SentenceTransformer), mỗi lần gửi đủ việc cho tất cả các tiến trình.
+        """
+        batch_size = batch_size or self.embed_batch_size
+        timings = timings if timings is not None else {}
+        step = batch_size * len(pool["processes"]) if pool is not None else batch_size
+        for start in range(0, len(contents), step):
+            batch_ids = chunk_ids[start:start + step]
+            start_time = time.perf_counter()
+            vectors = self.encode_texts(contents[start:start + step], batch_size, pool)
+            self.vector_db.save_embeddings(batch_ids, vectors, self.model_name)
+            embedded_time = time.perf_counter()
+            with self.index_lock:
+                self._ensure_writable_index()
+                self.index.add_with_ids(vectors, np.asarray(batch_ids, dtype=np.int64))
+                self._bump_index_version()
+            timings["embed"] = timings.get("embed", 0.0) + embedded_time - start_time
+            timings["index"] = timings.get("index", 0.0) + time.perf_counter() - embedded_time
+
+    def remove_chunks(self, chunk_ids: list):
+        """Xóa vector của các chunk khỏi FAISS index"""
+        if not chunk_ids:
+            return
+        if supports_remove(self.index):
+            with self.index_lock:
+                self._ensure_writable_index()
+                self.index.remove_ids(np.asarray(chunk_ids, dtype=np.int64))
+                self._bump_index_version()
+        else:
+            # HNSW không xóa được vector, dựng lại từ embedding đã lưu (các chunk đã bị xóa khỏi database)
+            self.rebuild_index_from_db()
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """Thay đổi tham số tìm kiếm (nprobe cho IVF, efSearch cho HNSW)"""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        with self.index_lock:
+            apply_search_params(self.index, self.nprobe, self.ef_search)
+            self._bump_index_version()
+
+    def evaluate_recall(self, k: int = 5, num_queries: int = 100, nprobe: int = None, ef_search: int = None) -> dict:
+        """Đo recall@k của index hiện tại so với index flat trên các embedding đã lưu
+
+        Câu truy vấn là các embedding chunk được chọn ngẫu nhiên; nprobe/ef_search
+        (nếu có) chỉ được áp dụng trong lần đo này.
+        """
+        chunk_ids, vectors = self.vector_db.get_embeddings(self.model_name)
+        if vectors is None:
+            return {"index_type": index_type_of(self.index), "k": k, "num_queries": 0, "recall_at_k": None}
+
+        exact_index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+        exact_index.add_with_ids(vectors, chunk_ids)
+        sample = np.random.default_rng().choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+
+        with self.index_lock:
+            apply_search_params(self.index, nprobe or self.nprobe, ef_search or self.ef_search)
+            try:
+                result = recall_at_k(self.index, exact_index, vectors[sample], k)
+            finally:
+                apply_search_params(self.index, self.nprobe, self.ef_search)
+        result.update({"nprobe": nprobe or self.nprobe, "ef_search": ef_search or self.ef_search})
+        return result
+
+    def update_file(self, file_path: str, save: bool = True) -> bool:
+        """Cập nhật database và FAISS index cho một file mới hoặc đã sửa
+
+        Chỉ các vector của file này bị xóa hoặc thêm, phần còn lại của index giữ nguyên.
+        """
+        return self.ingest_file(file_path, save=save)["changed"]
+
+    def ingest_file(self, file_path: str, file_hash: str = None, save: bool = True) -> dict:
+        """Parse, chia chunk, mã hóa và thêm một file vào FAISS index, đo thời gian từng bước
+
+        Returns:
+            dict: "changed", số chunk "added"/"removed" và "stages" {parse, embed, index: giây}.
+            Với file lớn (streaming), chunk được mã hóa ngay trong lúc parse nên thời gian
+            embed/index của các batch đó cũng nằm trong parse.
+        """
+        timings = {}
+        streamed = []
+
+        def on_chunks(chunk_ids: list, contents: list):
+            streamed.extend(chunk_ids)
+            self.add_chunks(chunk_ids, contents, timings=timings)
+
+        with self.update_lock:
+            start_time = time.perf_counter()
+            # Với file lớn (streaming), chunk mới được mã hóa và thêm vào index theo từng batch
+            result = self.vector_db.process_file(file_path, on_chunks=on_chunks, file_hash=file_hash)
+            timings["parse"] = time.perf_counter() - start_time - timings.get("embed", 0.0) - timings.get("index", 0.0)
+            if result["changed"]:
+                start_time = time.perf_counter()
+                self.remove_chunks(result["removed"])
+                timings["index"] = timings.get("index", 0.0) + time.perf_counter() - start_time
+                if result["added"]:
+                    contents = self.vector_db.get_chunks_by_ids(result["added"])
+                    added = [chunk_id for chunk_id in result["added"] if chunk_id in contents]
+                    self.add_chunks(added, [contents[chunk_id] for chunk_id in added], timings=timings)
+                if save:
+                    start_time = time.perf_counter()
+                    self._ensure_index_type()
+                    self.save_index()
+                    timings["index"] = timings.get("index", 0.0) + time.perf_counter() - start_time
+                    self._invalidate_responses()
+        num_added = len(result.get("added", [])) + len(streamed)
+        if num_added:
+            self._record_index_stats(num_added, timings.get("embed", 0.0) + timings.get("index", 0.0),
+                                     self.embed_batch_size, False)
+        return {
+            "changed": result["changed"],
+            "added": num_added,
+            "removed": len(result.get("removed", [])),
+            "stages": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        }
+
+    def update_files(self, file_paths: list, save: bool = True) -> dict:
+        """Cập nhật database và FAISS index cho nhiều file, parse song song trong process pool
+
+        Vector của tất cả các file thay đổi được xóa và thêm vào index trong một lần.
+        Returns:
+            dict: báo cáo của VectorDB.process_files (kết quả và lỗi theo từng file)
+        """
+        timings = {}
+        streamed = []
+
+        def on_chunks(chunk_ids: list, contents: list):
+            streamed.extend(chunk_ids)
+            self.add_chunks(chunk_ids, contents, timings=timings)
+
+        with self.update_lock:
+            report = self.vector_db.process_files(file_paths, on_chunks=on_chunks)
+            removed = [chunk_id for result in report["results"].values() for chunk_id in result["removed"]]
+            added = [chunk_id for result in report["results"].values() for chunk_id in result["added"]]
+
+            self.remove_chunks(removed)
+            multi_process = False
+            if added:
+                contents = self.vector_db.get_chunks_by_ids(added)
+                added = [chunk_id for chunk_id in added if chunk_id in contents]
+                # Giống embed_missing_chunks: chia việc mã hóa cho nhiều tiến trình nếu được bật
+                pool = self.model.start_multi_process_pool() if self.embed_multi_process else None
+                multi_process = pool is not None
+                try:
+                    self.add_chunks(added, [contents[chunk_id] for chunk_id in added], timings=timings, pool=pool)
+                finally:
+                    if pool is not None:
+                        self.model.stop_multi_process_pool(pool)
+            if added or streamed:
+                self._record_index_stats(len(added) + len(streamed), timings.get("embed", 0.0) + timings.get("index", 0.0),
+                                         self.embed_batch_size, multi_process)
+            if save and (removed or added):
+                self._ensure_index_type()
+                self.save_index()
+            if save and report.get("changed"):
+                self._invalidate_responses()
+            self.last_sync_report = report
+            return report
+
+    def remove_file(self, file_name: str, save: bool = True) -> bool:
+        """Xóa dữ liệu của file khỏi database và vector của file khỏi FAISS index"""
+        with self.update_lock:
+            removed_ids = self.vector_db.delete_file_data(file_name)
+            self.remove_chunks(removed_ids)
+            if save:
+                self.save_index()
+                if removed_ids:
+                    self._invalidate_responses()
+            return bool(removed_ids)
+
+    def encode_texts(self, texts: list, batch_size: int = None, pool=None) -> np.ndarray:
+        """Tạo vector embedding cho danh sách văn bản theo từng batch"""
+        batch_size = batch_size or self.embed_batch_size
+        if pool is not None:
+            vectors = self.model.encode_multi_process(texts, pool, batch_size=batch_size)
+        else:
+            vectors = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_missing_chunks(self, batch_size: int = None, multi_process: bool = None) -> int:
+        """Mã hóa các chunk chưa có embedding và lưu vào VectorDB
+
+        Chunks được mã hóa theo batch; nếu bật multi_process, việc mã hóa được chia
+        cho các tiến trình của SentenceTransformer.
+        """
+        batch_size = batch_size or self.embed_batch_size
+        if multi_process is None:
+            multi_process = self.embed_multi_process
+
+        start_time = time.time()
+        num_chunks = 0
+        pool = None
         try:
-            # Lấy danh sách các file trong thư mục
-            files = os.listdir(self.uploaded_files_dir)
-            
-            # Xóa index cũ và mapping cũ
-            self.index = faiss.IndexFlatL2(self.model.get_sentence_embedding_dimension())
-            self.chunk_id_mapping = []
-            
-            for file_name in files:
-                if file_name.endswith(('.txt', '.pdf', '.doc', '.docx', '.yaml', '.yml')):
-                    file_path = os.path.join(self.uploaded_files_dir, file_name)
-                    try:
-                        # Xử lý file với VectorDB
-                        self.vector_db.process_file(file_path)
-                        
-                        # Lấy chunks từ database
-                        chunks = self.vector_db.get_chunks_by_file(file_name)
-                        
-                        # Xử lý từng chunk
-                        for chunk_id, content, chunk_index in chunks:
-                            # Tạo vector embedding
-                            vector = self.model.encode(content, convert_to_tensor=False).reshape(1, -1)
-                            self.index.add(vector)
-                            # Lưu mapping giữa FAISS index và chunk_id
-                            self.chunk_id_mapping.append(chunk_id)
-                            
-                    except Exception as e:
-                        print(f"Lỗi khi xử lý file {file_name}: {str(e)}")
-                        continue
-            
-            # Lưu FAISS index và chunk mapping
-            faiss.write_index(self.index, FAISS_INDEX_PATH)
-            np.save(CHUNK_MAPPING_PATH, np.array(self.chunk_id_mapping))
-                    
-        except Exception as e:
-            print(f"Lỗi khi index files: {str(e)}")
-            raise
+            # Đọc các chunk theo từng trang để bộ nhớ không phụ thuộc số lượng chunk
+            last_id = 0
+            while True:
+                step = batch_size * len(pool["processes"]) if pool is not None else batch_size
+                chunks = self.vector_db.get_chunks_without_embedding(self.model_name, limit=step, after_id=last_id)
+                if not chunks:
+                    break
+                if multi_process and pool is None:
+                    # Với pool, mỗi lần gửi đủ việc cho tất cả các tiến trình
+                    pool = self.model.start_multi_process_pool()
+                chunk_ids = [chunk_id for chunk_id, _ in chunks]
+                vectors = self.encode_texts([content for _, content in chunks], batch_size, pool)
+                self.vector_db.save_embeddings(chunk_ids, vectors, self.model_name)
+                num_chunks += len(chunks)
+                last_id = chunk_ids[-1]
+        finally:
+            if pool is not None:
+                self.model.stop_multi_process_pool(pool)
 
-    def retrieve_context(self, query):
-        """Tìm kiếm file phù hợp nhất bằng FAISS."""
+        self._record_index_stats(num_chunks, time.time() - start_time, batch_size, pool is not None)
+        return num_chunks
+
+    def _record_index_stats(self, num_chunks: int, elapsed: float, batch_size: int, multi_process: bool):
+        """Ghi thống kê lần mã hóa gần nhất (hiển thị ở /rag/index-stats)"""
+        self.last_index_stats = {
+            "chunks": num_chunks,
+            "seconds": round(elapsed, 3),
+            "chunks_per_second": round(num_chunks / elapsed, 1) if elapsed > 0 else 0.0,
+            "batch_size": batch_size,
+            "multi_process": multi_process,
+        }
+        print(f"Đã mã hóa {num_chunks} chunks trong {elapsed:.2f}s "
+              f"({self.last_index_stats['chunks_per_second']} chunks/s, batch_size={batch_size})")
+
+    def encode_queries(self, queries: list) -> np.ndarray:
+        """Mã hóa câu hỏi, dùng lại embedding đã cache cho các câu hỏi lặp lại"""
+        vectors = [self.query_embedding_cache.get(query) for query in queries]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self.encode_texts([queries[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                self.query_embedding_cache.set(queries[i], vector)
+                vectors[i] = vector
+        return np.vstack(vectors).astype(np.float32)
+
+    def search(self, queries: list, k: int = None):
+        """Mã hóa nhiều câu hỏi trong một lần gọi và tìm kiếm bằng một lần index.search
+
+        Returns:
+            tuple: (distances, chunk_ids) với mỗi hàng ứng với một câu hỏi
+        """
+        query_vectors = self.encode_queries(queries)
+        with self.index_lock:
+            return self.index.search(query_vectors, k or self.top_k)
+
+    def _filter_candidates(self, filters: RetrievalFilters) -> tuple:
+        """(id, embedding hoặc None) của các chunk thỏa bộ lọc; embedding chỉ được tải khi tập đủ nhỏ"""
+        key = (filters, self.index_version)
+        cached = self.filter_cache.get(key)
+        if cached is not None:
+            return cached
+        chunk_ids = self.vector_db.get_filtered_chunk_ids(filters)
+        vectors = None
+        if 0 < len(chunk_ids) <= self.filter_brute_force_max:
+            chunk_ids, vectors = self.vector_db.get_filtered_embeddings(filters, self.model_name)
+        self.filter_cache.set(key, (chunk_ids, vectors))
+        return chunk_ids, vectors
+
+    def search_filtered(self, queries: list, k: int, filters: RetrievalFilters) -> list:
+        """Tìm kiếm vector chỉ trong các chunk thỏa bộ lọc (không lọc sau top-k toàn cục)
+
+        Tập nhỏ được so sánh vét cạn (khoảng cách L2 như index flat) với embedding đã lưu,
+        tập lớn được tìm trên FAISS index với IDSelectorBatch.
+        Returns:
+            list: với mỗi câu hỏi, tối đa k id chunk theo khoảng cách tăng dần
+        """
+        chunk_ids, vectors = self._filter_candidates(filters)
+        if len(chunk_ids) == 0:
+            return [[] for _ in queries]
+        query_vectors = self.encode_queries(queries)
+        if vectors is not None:
+            distances = ((query_vectors ** 2).sum(axis=1)[:, None] - 2 * query_vectors @ vectors.T
+                         + (vectors ** 2).sum(axis=1)[None, :])
+            k = min(k, len(chunk_ids))
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            rankings = []
+            for row, candidates in zip(distances, top):
+                order = candidates[np.argsort(row[candidates])]
+                rankings.append([int(chunk_ids[i]) for i in order])
+            return rankings
+
+        params, selector = selector_search_params(self.index, chunk_ids, self.nprobe, self.ef_search)
+        with self.index_lock:
+            _, indices = self.index.search(query_vectors, k, params=params)
+        return [[int(chunk_id) for chunk_id in row if chunk_id != -1] for row in indices]
+
+    def rank_chunks(self, queries: list, k: int = None, filters: RetrievalFilters = None) -> list:
+        """Xếp hạng chunk cho nhiều câu hỏi theo retrieval_mode
+
+        Ở chế độ hybrid, FAISS lấy hybrid_vector_k và BM25 lấy hybrid_bm25_k ứng viên,
+        hai danh sách được gộp bằng reciprocal-rank fusion với trọng số của từng nguồn.
+        Với filters, cả hai nguồn chỉ tìm trong các chunk của file thỏa bộ lọc.
+        Returns:
+            list: với mỗi câu hỏi, tối đa k id chunk theo độ liên quan giảm dần
+        """
+        k = k or self.top_k
+        mode = self.retrieval_mode
+        if mode != "vector" and not self.vector_db.fts_enabled:
+            mode = "vector"
+
+        if mode == "bm25":
+            return [[chunk_id for chunk_id, _ in row] for row in self.vector_db.search_bm25(queries, k, filters)]
+
+        vector_k = max(k, self.hybrid_vector_k) if mode == "hybrid" else k
+        if filters is not None:
+            vector_rankings = self.search_filtered(queries, vector_k, filters)
+        else:
+            _, indices = self.search(queries, vector_k)
+            vector_rankings = [[int(chunk_id) for chunk_id in row if chunk_id != -1] for row in indices]
+        if mode == "vector":
+            return vector_rankings
+
+        bm25_rankings = self.vector_db.search_bm25(queries, max(k, self.hybrid_bm25_k), filters)
+        return [
+            reciprocal_rank_fusion(
+                [vector_ranking, [chunk_id for chunk_id, _ in bm25_ranking]],
+                [self.hybrid_vector_weight, self.hybrid_bm25_weight],
+                self.rrf_k,
+            )[:k]
+            for vector_ranking, bm25_ranking in zip(vector_rankings, bm25_rankings)
+        ]
+
+    def _build_context(self, chunk_ids, chunks: dict) -> str:
+        """Ghép các chunk tìm được thành context trong ngân sách token (xem ContextAssembler)"""
+        if len(chunk_ids) == 0 or chunk_ids[0] == -1:
+            return "Không tìm thấy thông tin phù hợp."
+
+        # FAISS và FTS5 trả về trực tiếp id của chunk theo thứ tự độ liên quan;
+        # chunk liền kề/chồng lấn của cùng file được nối lại và đoạn trùng bị loại
+        context = context_assembler.assemble(chunk_ids, chunks)
+        if context:
+            return context
+        return "Không tìm thấy nội dung phù hợp."
+
+    def retrieve_contexts(self, queries: list, k: int = None, filters: RetrievalFilters = None) -> list:
+        """Tìm context cho nhiều câu hỏi cùng lúc bằng FAISS và/hoặc BM25 (xem rank_chunks).
+
+        Nội dung của tất cả các chunk tìm được được lấy từ database trong một truy vấn,
+        context được ghép trong ngân sách CONTEXT_MAX_TOKENS token.
+        """
         try:
-            # Tạo vector embedding cho câu hỏi
-            query_vector = self.model.encode(query, convert_to_tensor=False).reshape(1, -1)
-            
-            # Tìm kiếm 5 kết quả gần nhất
-            distances, indices = self.index.search(query_vector, 5)
-            
-            if indices[0][0] == -1 or len(self.chunk_id_mapping) == 0:
-                return "Không tìm thấy thông tin phù hợp."
-
-            # Lấy nội dung từ các chunks gần nhất
-            contexts = []
-            for idx in indices[0]:
-                if idx != -1 and idx < len(self.chunk_id_mapping):
-                    # Lấy chunk_id từ mapping
-                    chunk_id = self.chunk_id_mapping[idx]
-                    content = self.vector_db.get_chunk_by_id(chunk_id)
-                    if content:
-                        contexts.append(content)
-
-            # Kết hợp các contexts thành một đoạn văn bản
-            if contexts:
-                return "\n".join(contexts)
-            return "Không tìm thấy nội dung phù hợp."
+            k = k or self.default_k
+            # Key (gồm phiên bản index) được tính trước khi tìm kiếm: nếu index thay đổi trong lúc tìm,
+            # kết quả được lưu dưới phiên bản cũ thay vì bị dùng lại cho phiên bản mới
+            keys = [self._cache_key(query, k, filters) for query in queries]
+            results = [self.retrieval_cache.get(key) for key in keys]
+            missing = [i for i, result in enumerate(results) if result is None]
+            if missing:
+                missing_queries = [queries[i] for i in missing]
+                if self.reranker is not None:
+                    # Lấy nhiều ứng viên rồi để cross-encoder chọn ra k chunk
+                    rankings = self.rank_chunks(missing_queries, max(k, self.reranker.candidates), filters)
+                    chunks = self.vector_db.get_chunk_details([chunk_id for row in rankings for chunk_id in row])
+                    contents = {chunk_id: chunk["content"] for chunk_id, chunk in chunks.items()}
+                    rankings, reranked = self.reranker.rerank(missing_queries, rankings, contents, k)
+                else:
+                    reranked = True
+                    rankings = self.rank_chunks(missing_queries, k, filters)
+                    chunks = self.vector_db.get_chunk_details([chunk_id for row in rankings for chunk_id in row])
+                for i, row in zip(missing, rankings):
+                    results[i] = self._build_context(row, chunks)
+                    # Thứ tự chưa rerank (bỏ qua do vượt ngân sách) không được cache, lần sau rerank lại
+                    if reranked:
+                        self.retrieval_cache.set(keys[i], results[i])
+            return results
 
         except Exception as e:
             print(f"Lỗi khi tìm kiếm context: {str(e)}")
-            return "Có lỗi xảy ra khi tìm kiếm thông tin."
+            return ["Có lỗi xảy ra khi tìm kiếm thông tin."] * len(queries)
+
+    @property
+    def default_k(self) -> int:
+        """Số chunk đưa vào context khi không chỉ định k"""
+        return self.reranker.top_k if self.reranker is not None else self.top_k
+
+    def _cache_key(self, query: str, k: int, filters: RetrievalFilters = None) -> tuple:
+        """Key của cache kết quả tìm kiếm; phiên bản index tăng khi chunk được thêm hoặc xóa"""
+        return (query, k, self.retrieval_mode, self.index_version, filters)
+
+    def retrieve_context(self, query):
+        """Tìm kiếm context phù hợp nhất cho một câu hỏi."""
+        return self.retrieve_contexts([query])[0]
+
+    async def aretrieve_context(self, query: str, filters: RetrievalFilters = None) -> str:
+        """Tìm context trong thread pool để không chặn event loop
+
+        Các câu hỏi (không có bộ lọc) đến cách nhau vài ms được mã hóa và tìm kiếm chung một batch.
+        """
+        cached = self.retrieval_cache.get(self._cache_key(query, self.default_k, filters), record_miss=False)
+        if cached is not None:
+            return cached
+        if filters is not None:
+            return (await self.aretrieve_contexts([query], filters=filters))[0]
+        return await self.retrieval_batcher.submit(query)
+
+    async def aretrieve_contexts(self, queries: list, k: int = None, filters: RetrievalFilters = None) -> list:
+        """Tìm context cho nhiều câu hỏi (encode một lần, một lần index.search) trong thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.retrieval_executor, self.retrieve_contexts, queries, k, filters)
+
+    def cache_stats(self) -> dict:
+        """Thống kê hit/miss của cache embedding câu hỏi và cache kết quả tìm kiếm"""
+        return {
+            "index_version": self.index_version,
+            "query_embedding_cache": self.query_embedding_cache.stats(),
+            "retrieval_cache": self.retrieval_cache.stats(),
+        }
+
+    async def _retrieve_with_analysis(self, question: str, filters: RetrievalFilters = None) -> tuple:
+        """Tìm context; ở chế độ concurrent, lượt phân tích prompt chạy song song với bước tìm kiếm
 
-    async def query(self, question: str) -> str:
-        """Tìm kiếm và sinh câu trả lời từ LLM."""
+        Returns:
+            tuple: (context, kết quả phân tích hoặc None nếu LLM sẽ tự phân tích,
+                    câu trả lời trong response cache hoặc None)
+        """
+        mode = self.llm.analysis_mode
+        analysis_task = asyncio.create_task(self.llm.analyze(question)) if mode == "concurrent" else None
         try:
-            # Lấy context từ FAISS
-            context = self.retrieve_context(question)
-            
-            # Sử dụng generateContent với context từ RAG
-            response = await self.llm.generateContent(question, context)
+            with stage_timings.measure("retrieval", mode):
+                context = await self.aretrieve_context(question, filters)
+        except Exception:
+            if analysis_task is not None:
+                analysis_task.cancel()
+            raise
+
+        # Câu trả lời đã có trong cache: không cần chờ (và hủy) lượt phân tích
+        cached = await self.llm.cached_response(question, context, collection=self.collection)
+        if cached is not None:
+            if analysis_task is not None:
+                analysis_task.cancel()
+            return context, None, cached
+        analysis = await analysis_task if analysis_task is not None else None
+        return context, analysis, None
+
+    async def query(self, question: str, filters: RetrievalFilters = None) -> str:
+        """Tìm kiếm (chỉ trong các file thỏa filters nếu có) và sinh câu trả lời từ LLM."""
+        try:
+            with stage_timings.measure("total", self.llm.analysis_mode):
+                # Lấy context từ FAISS/BM25 (kèm phân tích prompt nếu chạy song song)
+                context, analysis, cached = await self._retrieve_with_analysis(question, filters)
+                if cached is not None:
+                    return cached
+                
+                # Sử dụng generateContent với context từ RAG
+                response = await self.llm.generateContent(question, context, analysis_response=analysis,
+                                                           check_cache=False, collection=self.collection)
             return response
 
         except Exception as e:
             print(f"Lỗi khi xử lý câu hỏi: {str(e)}")
             return "Xin lỗi, tôi không thể xử lý câu hỏi của bạn lúc này."
+
+    async def query_stream(self, question: str, filters: RetrievalFilters = None):
+        """Tìm context rồi trả về từng đoạn câu trả lời ngay khi LLM sinh ra"""
+        try:
+            context, analysis, cached = await self._retrieve_with_analysis(question, filters)
+        except Exception as e:
+            print(f"Lỗi khi xử lý câu hỏi: {str(e)}")
+            yield "Xin lỗi, tôi không thể xử lý câu hỏi của bạn lúc này."
+            return
+        if cached is not None:
+            yield cached
+            return
+
+        stream = self.llm.generateContentStream(question, context, analysis_response=analysis, check_cache=False,
+                                                collection=self.collection)
+        try:
+            async for text in stream:
+                yield text
+        finally:
+            await stream.aclose()
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from typing import List, Tuple
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Số ứng viên lấy từ bước tìm kiếm và số chunk giữ lại sau khi rerank
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "3"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "64"))
+# Bỏ qua rerank khi thời gian ước tính vượt ngân sách (ms), 0 = không giới hạn
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+# Hệ số làm mượt của trung bình động thời gian chấm điểm mỗi cặp
+LATENCY_EMA_ALPHA = 0.2
+
+_models = {}
+_lock = threading.Lock()
+
+
+def get_cross_encoder(model_name: str = RERANK_MODEL):
+    """Trả về CrossEncoder dùng chung cho cả process, chỉ tải ở lần gọi đầu tiên"""
+    with _lock:
+        if model_name not in _models:
+            from sentence_transformers import CrossEncoder
+            start_time = time.time()
+            _models[model_name] = CrossEncoder(model_name)
+            print(f"Đã tải model rerank {model_name} trong {time.time() - start_time:.2f}s")
+        return _models[model_name]
+
+
+class Reranker:
+    """Sắp xếp lại các chunk ứng viên bằng cross-encoder chấm điểm cặp (câu hỏi, chunk)
+
+    Các cặp của mọi câu hỏi trong một batch tìm kiếm được chấm điểm bằng một lần predict.
+    Thời gian chấm điểm mỗi cặp được theo dõi bằng trung bình động; nếu thời gian ước tính
+    cho batch vượt budget_ms, bước rerank bị bỏ qua và thứ tự tìm kiếm ban đầu được giữ.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, candidates: int = RERANK_CANDIDATES,
+                 top_k: int = RERANK_TOP_K, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS):
+        self.model_name = model_name
+        self.candidates = candidates
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.ms_per_pair = None
+        self.runs = 0
+        self.skipped = 0
+        self.over_budget = 0
+        self.total_ms = 0.0
+
+    @property
+    def model(self):
+        return get_cross_encoder(self.model_name)
+
+    def rerank(self, queries: List[str], candidates: List[list], contents: dict, top_k: int = None) -> Tuple[List[list], bool]:
+        """Sắp xếp lại danh sách id chunk ứng viên của từng câu hỏi
+
+        Args:
+            queries: các câu hỏi
+            candidates: với mỗi câu hỏi, danh sách id chunk theo thứ tự tìm kiếm
+            contents: {chunk_id: nội dung}
+            top_k: số chunk giữ lại cho mỗi câu hỏi
+        Returns:
+            tuple: (với mỗi câu hỏi tối đa top_k id chunk, True nếu đã rerank hoặc False nếu bỏ qua
+                    do vượt ngân sách và giữ thứ tự tìm kiếm ban đầu)
+        """
+        top_k = top_k or self.top_k
+        candidates = [[chunk_id for chunk_id in row if chunk_id in contents] for row in candidates]
+        pairs = [(query, contents[chunk_id]) for query, row in zip(queries, candidates) for chunk_id in row]
+        if not pairs:
+            return [row[:top_k] for row in candidates], True
+
+        # Ước tính thời gian từ các lần chạy trước; lần đầu luôn chạy để đo
+        if self.budget_ms > 0 and self.ms_per_pair is not None and self.ms_per_pair * len(pairs) > self.budget_ms:
+            self.skipped += 1
+            # Giảm dần ước tính để rerank được thử lại sau một đợt chậm tạm thời
+            self.ms_per_pair *= 1 - LATENCY_EMA_ALPHA
+            return [row[:top_k] for row in candidates], False
+
+        start_time = time.time()
+        scores = self.model.predict(pairs, batch_size=self.batch_size)
+        elapsed_ms = (time.time() - start_time) * 1000
+        self._record(elapsed_ms, len(pairs))
+
+        results = []
+        position = 0
+        for row in candidates:
+            row_scores = scores[position:position + len(row)]
+            position += len(row)
+            order = sorted(range(len(row)), key=lambda i: row_scores[i], reverse=True)
+            results.append([row[i] for i in order[:top_k]])
+        return results, True
+
+    def _record(self, elapsed_ms: float, num_pairs: int):
+        per_pair = elapsed_ms / num_pairs
+        if self.ms_per_pair is None:
+            self.ms_per_pair = per_pair
+        else:
+            self.ms_per_pair = LATENCY_EMA_ALPHA * per_pair + (1 - LATENCY_EMA_ALPHA) * self.ms_per_pair
+        self.runs += 1
+        self.total_ms += elapsed_ms
+        if self.budget_ms > 0 and elapsed_ms > self.budget_ms:
+            self.over_budget += 1
+
+    def stats(self) -> dict:
+        """Số lần rerank, bỏ qua do vượt ngân sách và thời gian trung bình"""
+        return {
+            "model": self.model_name,
+            "candidates": self.candidates,
+            "top_k": self.top_k,
+            "budget_ms": self.budget_ms,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "over_budget": self.over_budget,
+            "avg_ms": round(self.total_ms / self.runs, 2) if self.runs else 0.0,
+            "ms_per_pair": round(self.ms_per_pair, 4) if self.ms_per_pair is not None else None,
+        }
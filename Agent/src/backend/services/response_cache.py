@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from services.vector_db import ConnectionPool
+from services.embedding import EMBEDDING_MODEL, get_embedding_model
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+# So khớp gần đúng: câu hỏi có embedding đủ giống với câu hỏi đã cache trên cùng context
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Cache câu trả lời của LLM lưu trong SQLite
+
+    Key chính xác là hash của (prompt, context RAG/web/file, model, chế độ phân tích prompt,
+    collection). Nếu bật semantic, các câu hỏi có cùng context được so khớp theo cosine
+    similarity của embedding. Mục quá hạn TTL bị bỏ qua, khi vượt max_entries các mục ít được
+    dùng nhất bị xóa. Các mục có context RAG của một collection bị xóa khi tài liệu của
+    collection đó thay đổi (invalidate_documents).
+    """
+
+    def __init__(self, db_path: str = RESPONSE_CACHE_PATH, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl: float = RESPONSE_CACHE_TTL, semantic: bool = RESPONSE_CACHE_SEMANTIC,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY, model_name: str = EMBEDDING_MODEL):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.similarity = similarity
+        self.model_name = model_name
+        self.pool = ConnectionPool(db_path, size=4)
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self.init_db()
+
+    def init_db(self):
+        """Khởi tạo bảng cache"""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        context_key TEXT NOT NULL,
+                        has_documents INTEGER NOT NULL,
+                        prompt TEXT NOT NULL,
+                        response TEXT NOT NULL,
+                        embedding BLOB,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL,
+                        hits INTEGER DEFAULT 0,
+                        collection TEXT
+                    )
+                ''')
+                # Cache tạo trước khi có collection
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(responses)")}
+                if "collection" not in columns:
+                    conn.execute("ALTER TABLE responses ADD COLUMN collection TEXT")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_context ON responses (context_key)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        except Exception as e:
+            print(f"Lỗi khi khởi tạo response cache: {str(e)}")
+            raise
+
+    def _keys(self, prompt: str, contexts: tuple, model: str, collection: str = None) -> tuple:
+        context_key = _digest(list(contexts), model, collection)
+        return _digest(prompt, context_key), context_key
+
+    def _embed(self, prompt: str) -> np.ndarray:
+        vector = np.asarray(get_embedding_model(self.model_name).encode([prompt])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, prompt: str, contexts: tuple, model: str, collection: str = None):
+        """Tìm câu trả lời đã cache cho prompt với cùng context, model và collection, None nếu không có"""
+        key, context_key = self._keys(prompt, contexts, model, collection)
+        now = time.time()
+        min_created = now - self.ttl
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                                   (key, min_created)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+                    self._count("exact_hits")
+                    return row[0]
+
+                if self.semantic:
+                    rows = conn.execute("""
+                        SELECT key, response, embedding FROM responses
+                        WHERE context_key = ? AND created_at >= ? AND embedding IS NOT NULL
+                    """, (context_key, min_created)).fetchall()
+                    if rows:
+                        query = self._embed(prompt)
+                        matrix = np.vstack([np.frombuffer(blob, dtype=np.float32) for _, _, blob in rows])
+                        scores = matrix @ query
+                        best = int(np.argmax(scores))
+                        if scores[best] >= self.similarity:
+                            conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                                         (now, rows[best][0]))
+                            self._count("semantic_hits")
+                            return rows[best][1]
+            self._count("misses")
+            return None
+        except Exception as e:
+            # Lỗi cache không được làm hỏng việc sinh câu trả lời
+            print(f"Lỗi khi đọc response cache: {str(e)}")
+            return None
+
+    def set(self, prompt: str, contexts: tuple, model: str, response: str, collection: str = None):
+        """Lưu câu trả lời, xóa mục hết hạn và mục ít dùng nhất khi vượt max_entries"""
+        key, context_key = self._keys(prompt, contexts, model, collection)
+        now = time.time()
+        try:
+            embedding = self._embed(prompt).tobytes() if self.semantic else None
+            # contexts[0] là context RAG lấy từ tài liệu đã upload
+            has_documents = int(bool(contexts and contexts[0]))
+            with self.pool.connection() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO responses
+                        (key, context_key, has_documents, prompt, response, embedding, created_at, last_used,
+                         collection)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (key, context_key, has_documents, prompt, response, embedding, now, now, collection))
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    conn.execute("""
+                        DELETE FROM responses WHERE key IN (
+                            SELECT key FROM responses ORDER BY last_used LIMIT ?
+                        )
+                    """, (count - self.max_entries,))
+        except Exception as e:
+            print(f"Lỗi khi ghi response cache: {str(e)}")
+
+    def invalidate_documents(self, collection: str = None):
+        """Xóa các câu trả lời dựa trên context RAG (gọi khi tài liệu thay đổi)
+
+        Với collection, chỉ các câu trả lời của collection đó (và các câu trả lời không gắn
+        collection) bị xóa.
+        """
+        try:
+            with self.pool.connection() as conn:
+                if collection is None:
+                    deleted = conn.execute("DELETE FROM responses WHERE has_documents = 1").rowcount
+                else:
+                    deleted = conn.execute("""
+                        DELETE FROM responses
+                        WHERE has_documents = 1 AND (collection = ? OR collection IS NULL)
+                    """, (collection,)).rowcount
+            if deleted:
+                print(f"Đã xóa {deleted} câu trả lời trong cache do tài liệu thay đổi")
+        except Exception as e:
+            print(f"Lỗi khi xóa response cache: {str(e)}")
+
+    def clear(self):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM responses")
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> dict:
+        """Số lần hit (chính xác/gần đúng), miss và số mục đang lưu"""
+        with self.pool.connection() as conn:
+            size = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / total, 4) if total else 0.0,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "semantic": self.semantic,
+            "similarity": self.similarity,
+        }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Trả về ResponseCache dùng chung, None nếu cache bị tắt"""
+    global _shared_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache()
+        return _shared_cache
@@ -0,0 +1,39 @@
+import json
+from typing import AsyncIterator
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Định dạng một sự kiện Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_stream(request: Request, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Chuyển từng đoạn văn bản thành sự kiện "token", kết thúc bằng sự kiện "done"
+
+    Khi client ngắt kết nối, luồng chunks được đóng để hủy lời gọi LLM phía upstream.
+    """
+    try:
+        async for text in chunks:
+            if await request.is_disconnected():
+                print("Client đã ngắt kết nối, dừng sinh nội dung")
+                break
+            yield sse_event("token", {"text": text})
+        else:
+            yield sse_event("done", {})
+    except Exception as e:
+        print(f"Lỗi khi stream nội dung: {str(e)}")
+        yield sse_event("error", {"detail": str(e)})
+    finally:
+        await chunks.aclose()
+
+
+def sse_response(request: Request, chunks: AsyncIterator[str]) -> StreamingResponse:
+    """Trả về StreamingResponse dạng text/event-stream từ một async generator văn bản"""
+    return StreamingResponse(
+        _sse_stream(request, chunks),
+        media_type="text/event-stream",
+        # Tắt cache và buffer của proxy để token đến client ngay lập tức
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
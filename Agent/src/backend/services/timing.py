@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class StageTimings:
+    """Thống kê thời gian (ms) của từng giai đoạn xử lý câu hỏi, tách theo chế độ
+
+    Mỗi cặp (chế độ, giai đoạn) giữ window mẫu gần nhất để tính trung bình và phân vị.
+    """
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage: str, mode: str = "default"):
+        """Đo thời gian của đoạn code trong khối with (dùng được với await bên trong)"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start_time) * 1000, mode)
+
+    def record(self, stage: str, elapsed_ms: float, mode: str = "default"):
+        with self._lock:
+            key = (mode, stage)
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(elapsed_ms)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        """{chế độ: {giai đoạn: số lần, trung bình, p50, p95}}"""
+        with self._lock:
+            items = [(key, sorted(samples), self._counts[key]) for key, samples in self._samples.items()]
+        result = {}
+        for (mode, stage), samples, count in items:
+            result.setdefault(mode, {})[stage] = {
+                "count": count,
+                "avg_ms": round(sum(samples) / len(samples), 2),
+                "p50_ms": round(samples[len(samples) // 2], 2),
+                "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+            }
+        return result
+
+
+# Dùng chung cho LLM và các service
+stage_timings = StageTimings()
@@ -1,59 +1,261 @@
 import os
+import hashlib
+import queue
 import sqlite3
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from services.chunker import CHUNKER, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, get_chunker
+from services.embedding import EMBEDDING_MODEL
+import numpy as np
 from bs4 import BeautifulSoup
 import PyPDF2
 from docx import Document
 import re
 import yaml
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, timezone
+
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+# Số tiến trình parse file song song khi đồng bộ thư mục (1 = parse tuần tự trong tiến trình chính)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+# File lớn hơn ngưỡng này được xử lý dạng streaming: trích xuất theo trang, ghi và mã hóa chunk theo batch
+STREAMING_MIN_FILE_SIZE = int(os.getenv("STREAMING_MIN_FILE_SIZE", str(20 * 1024 * 1024)))
+STREAMING_BATCH_CHUNKS = int(os.getenv("STREAMING_BATCH_CHUNKS", "256"))
+
+# Bộ lọc tìm kiếm theo metadata của file (dùng được làm key cache)
+RetrievalFilters = namedtuple("RetrievalFilters", ["file_names", "extensions", "updated_after", "updated_before"])
+# Ký tự đặc biệt của LIKE cần escape khi so khớp nguyên văn
+LIKE_SPECIAL = re.compile(r"[\\%_]")
+
+def _normalize_time(value: str) -> str:
+    """Chuyển thời gian ISO 8601 về dạng UTC 'YYYY-MM-DD HH:MM:SS' như CURRENT_TIMESTAMP của SQLite"""
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+def make_filters(file_names: list = None, extensions: list = None,
+                 updated_after: str = None, updated_before: str = None):
+    """Tạo RetrievalFilters, None nếu không có điều kiện nào
+
+    Raises:
+        ValueError: khi updated_after/updated_before không đúng định dạng ISO 8601
+    """
+    if not (file_names or extensions or updated_after or updated_before):
+        return None
+    return RetrievalFilters(
+        tuple(sorted(set(file_names or ()))),
+        tuple(sorted({"." + extension.lower().lstrip(".") for extension in extensions or ()})),
+        _normalize_time(updated_after),
+        _normalize_time(updated_before),
+    )
+
+def hash_text(text: str) -> str:
+    """Tính SHA-256 của một đoạn văn bản"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def hash_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Tính SHA-256 của nội dung file, đọc theo từng khối để không tốn bộ nhớ"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def iter_document(file_path: str) -> Iterator[str]:
+    """Trích xuất văn bản của file theo từng trang (PDF), đoạn (DOCX) hoặc khối (text)"""
+    from services.file_manager import iter_pdf_pages, iter_docx_paragraphs, iter_txt_file, read_yaml
+    file_name = os.path.basename(file_path)
+    if file_name.endswith('.pdf'):
+        yield from iter_pdf_pages(file_path)
+    elif file_name.endswith(('.txt', '.md')):
+        yield from iter_txt_file(file_path)
+    elif file_name.endswith(('.doc', '.docx')):
+        yield from iter_docx_paragraphs(file_path)
+    elif file_name.endswith(('.yaml', '.yml')):
+        yield read_yaml(file_path)
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield f.read()
+
+def read_document(file_path: str) -> str:
+    """Trích xuất toàn bộ văn bản của file theo định dạng"""
+    return "".join(iter_document(file_path))
+
+def parse_file(file_path: str, chunker_args: tuple,
+               known_file_hash: str = None, known_content_hash: str = None, file_hash: str = None) -> dict:
+    """Hash, trích xuất và tách chunk một file, không truy cập database
+
+    Hàm chạy được trong tiến trình con của ProcessPoolExecutor, chunker được tạo lại
+    trong tiến trình từ chunker_args (xem get_chunker). known_file_hash và
+    known_content_hash là hash đang lưu trong database, dùng để bỏ qua phần việc
+    không cần thiết khi file hoặc nội dung không đổi. file_hash là hash đã tính sẵn
+    (ví dụ trong lúc upload) để không phải đọc lại file.
+    """
+    parsed = {"name": os.path.basename(file_path), "file_hash": file_hash or hash_file(file_path)}
+    if parsed["file_hash"] == known_file_hash:
+        parsed["status"] = "unchanged"
+        return parsed
+
+    content = read_document(file_path)
+    parsed["content_hash"] = hash_text(content)
+    if parsed["content_hash"] == known_content_hash:
+        parsed["status"] = "same_content"
+        return parsed
+
+    chunker = get_chunker(*chunker_args)
+    parsed["status"] = "changed"
+    parsed["size"] = len(content)
+    parsed["chunker"] = chunker.signature
+    parsed["chunks"] = [
+        (chunk.content, hash_text(chunk.content), chunk.start_offset, chunk.end_offset, chunk.token_count)
+        for chunk in chunker.iter_chunks([content])
+    ]
+    return parsed
+
+class ConnectionPool:
+    """Pool các kết nối SQLite dùng chung giữa các thread
+
+    Mỗi kết nối bật WAL để việc đọc không bị chặn khi đang ghi, cùng các pragma
+    synchronous, cache_size và mmap_size.
+    """
+
+    def __init__(self, db_path: str, size: int = SQLITE_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    return self._connect()
+            # Pool đã đầy, chờ một kết nối được trả lại
+            return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        """Mượn một kết nối: commit khi thành công, rollback khi có lỗi"""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close_all(self):
+        """Đóng tất cả các kết nối đang rảnh"""
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
 
 class VectorDB:
-    _instance = None
+    # Một instance cho mỗi file database (mỗi collection có database riêng)
+    _instances = {}
+    _instances_lock = threading.Lock()
     
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(VectorDB, cls).__new__(cls)
-            cls._instance.db_path = "vector_store.db"
-            cls._instance.uploaded_files_dir = "uploaded_files"
-            cls._instance.chunk_size = 1000
-            cls._instance.chunk_overlap = 100
-            cls._instance.current_version = 2
-            if not os.path.exists(cls._instance.db_path):
-                print("Database không tồn tại, tạo mới...")
-                cls._instance.init_db()
-        return cls._instance
+    def __new__(cls, db_path: str = "vector_store.db", uploaded_files_dir: str = "uploaded_files"):
+        with cls._instances_lock:
+            if db_path not in cls._instances:
+                cls._instances[db_path] = cls._create(db_path, uploaded_files_dir)
+            return cls._instances[db_path]
+
+    @classmethod
+    def _create(cls, db_path: str, uploaded_files_dir: str):
+        instance = super(VectorDB, cls).__new__(cls)
+        instance.db_path = db_path
+        instance.uploaded_files_dir = uploaded_files_dir
+        instance.chunk_size = 1000
+        instance.chunk_overlap = 100
+        instance.chunker_kind = CHUNKER
+        instance.chunk_max_tokens = CHUNK_MAX_TOKENS
+        instance.chunk_overlap_tokens = CHUNK_OVERLAP_TOKENS
+        instance.embedding_model = EMBEDDING_MODEL
+        instance.current_version = 5
+        # Kiểu dữ liệu lưu embedding trong cột BLOB (float16 tiết kiệm một nửa dung lượng)
+        instance.embedding_dtype = np.dtype(os.getenv("EMBEDDING_DTYPE", "float16"))
+        instance.pool = ConnectionPool(instance.db_path)
+        instance.fts_enabled = False
+        if not os.path.exists(instance.db_path):
+            print("Database không tồn tại, tạo mới...")
+        # Luôn chạy init_db để database cũ được cập nhật lên phiên bản mới
+        instance.init_db()
+        return instance
+
+    @classmethod
+    def release(cls, db_path: str):
+        """Đóng các kết nối và bỏ instance của database (khi collection bị giải phóng khỏi bộ nhớ)"""
+        with cls._instances_lock:
+            instance = cls._instances.pop(db_path, None)
+        if instance is not None:
+            instance.pool.close_all()
+
+    def connection(self):
+        """Lấy một kết nối từ pool (dùng với câu lệnh with)"""
+        return self.pool.connection()
 
     def init_db(self):
         """Khởi tạo database SQLite"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Tạo bảng version để quản lý phiên bản database
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS version (
-                    id INTEGER PRIMARY KEY,
-                    version INTEGER NOT NULL
-                )
-            ''')
-            
-            # Kiểm tra phiên bản database
-            cursor.execute("SELECT version FROM version WHERE id = 1")
-            result = cursor.fetchone()
-            
-            if result is None:
-                # Database mới, tạo cấu trúc ban đầu
-                self._create_initial_schema(cursor)
-                cursor.execute("INSERT INTO version (id, version) VALUES (1, ?)", (self.current_version,))
-            else:
-                db_version = result[0]
-                if db_version < self.current_version:
-                    # Cập nhật cấu trúc database nếu cần
-                    self._update_schema(cursor, db_version)
-                    cursor.execute("UPDATE version SET version = ? WHERE id = 1", (self.current_version,))
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Tạo bảng version để quản lý phiên bản database
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS version (
+                        id INTEGER PRIMARY KEY,
+                        version INTEGER NOT NULL
+                    )
+                ''')
+                
+                # Kiểm tra phiên bản database
+                cursor.execute("SELECT version FROM version WHERE id = 1")
+                result = cursor.fetchone()
+                
+                if result is None:
+                    # Database mới, tạo cấu trúc ban đầu
+                    self._create_initial_schema(cursor)
+                    cursor.execute("INSERT INTO version (id, version) VALUES (1, ?)", (self.current_version,))
+                else:
+                    db_version = result[0]
+                    if db_version < self.current_version:
+                        # Cập nhật cấu trúc database nếu cần
+                        self._update_schema(cursor, db_version)
+                        cursor.execute("UPDATE version SET version = ? WHERE id = 1", (self.current_version,))
+
+                self.fts_enabled = self._ensure_fts(cursor)
             
-            conn.commit()
-            conn.close()
             print("Đã khởi tạo/cập nhật database thành công")
         except Exception as e:
             print(f"Lỗi khi khởi tạo database: {str(e)}")
@@ -67,6 +269,9 @@ class VectorDB:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL UNIQUE,
                 size INTEGER NOT NULL,
+                file_hash TEXT,
+                content_hash TEXT,
+                chunker TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
@@ -78,7 +283,14 @@ class VectorDB:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 file_id INTEGER NOT NULL,
                 content TEXT NOT NULL,
+                chunk_hash TEXT,
                 chunk_index INTEGER NOT NULL,
+                start_offset INTEGER,
+                end_offset INTEGER,
+                token_count INTEGER,
+                embedding BLOB,
+                embedding_model TEXT,
+                embedding_dim INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (file_id) REFERENCES files (id),
                 UNIQUE(file_id, chunk_index)
@@ -131,105 +343,391 @@ class VectorDB:
                 cursor.execute("DROP TABLE IF EXISTS documents_backup")
                 raise
 
+        if old_version < 3:
+            # Lưu embedding của chunk ngay trong database
+            self._add_column_if_missing(cursor, "chunks", "embedding", "BLOB")
+            self._add_column_if_missing(cursor, "chunks", "embedding_model", "TEXT")
+            self._add_column_if_missing(cursor, "chunks", "embedding_dim", "INTEGER")
+
+        if old_version < 4:
+            # Hash nội dung để phát hiện thay đổi và tái sử dụng embedding theo từng chunk
+            self._add_column_if_missing(cursor, "files", "file_hash", "TEXT")
+            self._add_column_if_missing(cursor, "files", "content_hash", "TEXT")
+            self._add_column_if_missing(cursor, "chunks", "chunk_hash", "TEXT")
+            cursor.connection.create_function("hash_text", 1, hash_text)
+            cursor.execute("UPDATE chunks SET chunk_hash = hash_text(content) WHERE chunk_hash IS NULL")
+
+        if old_version < 5:
+            # Vị trí ký tự và số token của chunk, cách chia chunk đã dùng cho file
+            self._add_column_if_missing(cursor, "files", "chunker", "TEXT")
+            self._add_column_if_missing(cursor, "chunks", "start_offset", "INTEGER")
+            self._add_column_if_missing(cursor, "chunks", "end_offset", "INTEGER")
+            self._add_column_if_missing(cursor, "chunks", "token_count", "INTEGER")
+
+    def _ensure_fts(self, cursor) -> bool:
+        """Tạo bảng FTS5 trên chunks.content (external content) cùng các trigger đồng bộ
+
+        Trigger cập nhật chunks_fts mỗi khi chunk được thêm, xóa hoặc sửa nội dung. Khi bảng
+        mới được tạo, chỉ mục được dựng từ các chunk hiện có. Trả về False nếu SQLite
+        không hỗ trợ FTS5 (tìm kiếm BM25 bị tắt).
+        """
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='chunks_fts'")
+        if cursor.fetchone() is not None:
+            return True
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE chunks_fts USING fts5(
+                    content, content='chunks', content_rowid='id'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            print(f"SQLite không hỗ trợ FTS5, tắt tìm kiếm BM25: {str(e)}")
+            return False
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF content ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        cursor.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+        print("Đã tạo chỉ mục FTS5 cho chunks")
+        return True
+
+    def _add_column_if_missing(self, cursor, table: str, column: str, definition: str):
+        """Thêm cột vào bảng nếu cột chưa tồn tại"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def chunker_args(self) -> tuple:
+        """Tham số của get_chunker, truyền được sang tiến trình con"""
+        return (self.chunker_kind, self.chunk_size, self.chunk_overlap,
+                self.chunk_max_tokens, self.chunk_overlap_tokens, self.embedding_model)
+
+    @property
+    def chunker(self):
+        return get_chunker(*self.chunker_args())
+
     def split_text(self, text: str) -> list:
-        """Tách văn bản thành các chunk với kích thước và overlap được chỉ định."""
-        chunks = []
-        start = 0
-        text_length = len(text)
-        
-        while start < text_length:
-            end = start + self.chunk_size
-            
-            if end >= text_length:
-                chunks.append(text[start:])
-                break
-                
-            # Tìm vị trí kết thúc chunk phù hợp (kết thúc câu hoặc dấu xuống dòng)
-            while end > start and text[end] not in ['.', '!', '?', '\n']:
-                end -= 1
-                
-            if end == start:
-                end = start + self.chunk_size
-                
-            chunks.append(text[start:end])
-            start = end - self.chunk_overlap
-            
-        return chunks
+        """Tách văn bản thành các chunk theo chunker đã cấu hình."""
+        return [chunk.content for chunk in self.chunker.split(text)]
+
+    def _get_file_hashes(self) -> dict:
+        """Lấy {tên file: (id, file_hash, content_hash)} của các file trong database
+
+        File được chia chunk theo cách khác với chunker hiện tại không có hash, để được xử lý lại.
+        """
+        signature = self.chunker.signature
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, id, file_hash, content_hash, chunker FROM files")
+            return {
+                name: (file_id, file_hash, content_hash) if chunker == signature else (file_id, None, None)
+                for name, file_id, file_hash, content_hash, chunker in cursor.fetchall()
+            }
+
+    def get_stale_files(self) -> set:
+        """Tên các file cần xử lý lại dù không bị sửa: chia chunk theo cách khác hoặc chưa xử lý xong"""
+        return {name for name, (_, file_hash, _) in self._get_file_hashes().items() if file_hash is None}
+
+    def process_file(self, file_path: str, on_chunks: Callable[[list, list], None] = None,
+                     file_hash: str = None) -> dict:
+        """Xử lý file và lưu vào database chỉ khi nội dung thay đổi
 
-    def process_file(self, file_path: str):
-        from services.file_manager import read_pdf, read_docx, read_yaml, read_txt_file
-        """Xử lý file và lưu vào database chỉ khi nội dung thay đổi"""
+        File không đổi (cùng hash byte) được bỏ qua trước khi parse. Khi nội dung thay đổi,
+        các chunk có cùng hash được giữ nguyên (kèm embedding), chỉ chunk mới được thêm vào.
+        Trả về dict gồm "changed", "removed" (id các chunk đã xóa) và "added" (id các chunk mới)
+        để FAISS index chỉ cần cập nhật phần vector của file này.
+        File lớn hơn STREAMING_MIN_FILE_SIZE được xử lý bằng process_file_streaming.
+        file_hash là SHA-256 của file nếu đã được tính sẵn.
+        """
+        if os.path.getsize(file_path) >= STREAMING_MIN_FILE_SIZE:
+            return self.process_file_streaming(file_path, on_chunks, file_hash=file_hash)
         try:
-            file_name = os.path.basename(file_path)
-            
-            # Đọc nội dung file
-            if file_name.endswith('.pdf'):
-                content = read_pdf(file_path)
-            elif file_name.endswith(('.txt', '.md')):
-                content = read_txt_file(file_path)
-            elif file_name.endswith(('.doc', '.docx')):
-                content = read_docx(file_path)
-            elif file_name.endswith(('.yaml', '.yml')):
-                content = read_yaml(file_path)
-            else:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            
-            # Kết nối database
-            with sqlite3.connect(self.db_path) as conn:
+            known = self._get_file_hashes().get(os.path.basename(file_path), (None, None, None))
+            parsed = parse_file(file_path, self.chunker_args(), known[1], known[2], file_hash)
+            return self.write_parsed_file(parsed)
+        except Exception as e:
+            print(f"Lỗi khi xử lý file {file_path}: {str(e)}")
+            raise
+
+    def process_files(self, file_paths: list, workers: int = None,
+                      on_chunks: Callable[[list, list], None] = None) -> dict:
+        """Parse nhiều file song song trong process pool, ghi database tuần tự
+
+        Việc hash, trích xuất văn bản và tách chunk (PyPDF2, python-docx) chạy trong các
+        tiến trình con; kết quả được ghi vào database lần lượt theo thứ tự file_paths bởi
+        tiến trình chính. Lỗi của một file được ghi nhận mà không làm dừng các file khác.
+        File lớn được xử lý dạng streaming trong tiến trình chính (xem process_file_streaming).
+
+        Returns:
+            dict: "results" {tên file: kết quả của write_parsed_file}, "failed" {tên file: lỗi},
+            cùng số file đã thay đổi, bỏ qua, lỗi và thời gian xử lý
+        """
+        workers = PARSE_WORKERS if workers is None else workers
+        known = self._get_file_hashes()
+        chunker_args = self.chunker_args()
+        report = {"results": {}, "failed": {}, "changed": 0, "skipped": 0, "workers": 1}
+        start_time = time.time()
+
+        def job_args(file_path):
+            _, file_hash, content_hash = known.get(os.path.basename(file_path), (None, None, None))
+            return (file_path, chunker_args, file_hash, content_hash)
+
+        streamed = {path for path in file_paths
+                    if os.path.exists(path) and os.path.getsize(path) >= STREAMING_MIN_FILE_SIZE}
+        pooled = [path for path in file_paths if path not in streamed]
+
+        executor = None
+        if workers > 1 and len(pooled) > 1:
+            report["workers"] = min(workers, len(pooled))
+            # spawn thay vì fork: tiến trình chính đang có các thread (warm-up, FAISS, torch)
+            executor = ProcessPoolExecutor(max_workers=report["workers"],
+                                           mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = {path: executor.submit(parse_file, *job_args(path)) for path in pooled} if executor else {}
+            for position, file_path in enumerate(file_paths):
+                file_name = os.path.basename(file_path)
+                try:
+                    if file_path in streamed:
+                        report["results"][file_name] = result = self.process_file_streaming(file_path, on_chunks)
+                        report["changed" if result["changed"] else "skipped"] += 1
+                        print(f"[{position + 1}/{len(file_paths)}] {file_name}: "
+                              f"{'đã cập nhật' if result['changed'] else 'không thay đổi'} (streaming)")
+                        continue
+                    try:
+                        parsed = futures[file_path].result() if executor else parse_file(*job_args(file_path))
+                    except BrokenProcessPool:
+                        # Process pool bị hỏng (tiến trình con bị kill), parse tiếp trong tiến trình chính
+                        print("Process pool bị dừng đột ngột, chuyển sang parse tuần tự")
+                        executor.shutdown(cancel_futures=True)
+                        executor = None
+                        parsed = parse_file(*job_args(file_path))
+                    result = self.write_parsed_file(parsed)
+                except Exception as e:
+                    report["failed"][file_name] = str(e)
+                    print(f"[{position + 1}/{len(file_paths)}] Lỗi khi xử lý file {file_name}: {str(e)}")
+                    continue
+                report["results"][file_name] = result
+                if result["changed"]:
+                    report["changed"] += 1
+                else:
+                    report["skipped"] += 1
+                print(f"[{position + 1}/{len(file_paths)}] {file_name}: "
+                      f"{'đã cập nhật' if result['changed'] else 'không thay đổi'}")
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        report["failed_count"] = len(report["failed"])
+        report["seconds"] = round(time.time() - start_time, 3)
+        print(f"Đã xử lý {len(file_paths)} files trong {report['seconds']}s: {report['changed']} thay đổi, "
+              f"{report['skipped']} không đổi, {report['failed_count']} lỗi")
+        return report
+
+    def process_file_streaming(self, file_path: str, on_chunks: Callable[[list, list], None] = None,
+                               batch_chunks: int = None, file_hash: str = None) -> dict:
+        """Xử lý file lớn với bộ nhớ giới hạn, không phụ thuộc kích thước tài liệu
+
+        Văn bản được trích xuất theo trang/đoạn và tách chunk dạng luồng; mỗi batch
+        batch_chunks chunk được ghi vào database trong một transaction riêng và chuyển cho
+        on_chunks(chunk_ids, contents) (ví dụ để mã hóa và thêm vào FAISS index) ngay lập tức.
+        file_hash chỉ được ghi khi xử lý xong nên file bị gián đoạn sẽ được xử lý lại ở lần
+        đồng bộ sau. Các chunk đã chuyển cho on_chunks không có trong "added" của kết quả.
+        """
+        batch_chunks = batch_chunks or STREAMING_BATCH_CHUNKS
+        file_name = os.path.basename(file_path)
+        try:
+            file_hash = file_hash or hash_file(file_path)
+            with self.connection() as conn:
                 cursor = conn.cursor()
-                
-                # Kiểm tra file hiện tại trong database
-                cursor.execute("SELECT id, size FROM files WHERE name = ?", (file_name,))
+                cursor.execute("SELECT id, file_hash, chunker FROM files WHERE name = ?", (file_name,))
                 result = cursor.fetchone()
-                
-                # Nếu file đã tồn tại, kiểm tra xem nội dung có thay đổi không
-                if result:
-                    file_id, old_size = result
-                    if old_size == len(content):
-                        # Nội dung không thay đổi, không cần xử lý lại
-                        cursor.execute("UPDATE files SET updated_at = CURRENT_TIMESTAMP WHERE id = ?", (file_id,))
-                        conn.commit()
-                        return  # Thoát nếu không cần cập nhật
-                
-                # Tách nội dung thành chunks
-                chunks = self.split_text(content)
-                
-                # Thêm hoặc cập nhật thông tin file
+                if result and result[1] == file_hash and result[2] == self.chunker.signature:
+                    return {"changed": False, "removed": [], "added": []}
+
+                if result is None:
+                    cursor.execute("INSERT INTO files (name, size) VALUES (?, 0)", (file_name,))
+                    file_id = cursor.lastrowid
+                else:
+                    file_id = result[0]
+                    cursor.execute("UPDATE files SET file_hash = NULL, content_hash = NULL WHERE id = ?", (file_id,))
+
+                # Gom các chunk cũ theo hash để tái sử dụng, chunk_index tạm thời là số âm
+                cursor.execute("SELECT id, chunk_hash FROM chunks WHERE file_id = ? ORDER BY chunk_index", (file_id,))
+                old_chunks = {}
+                for chunk_id, chunk_hash in cursor.fetchall():
+                    old_chunks.setdefault(chunk_hash, []).append(chunk_id)
+                cursor.execute("UPDATE chunks SET chunk_index = -id WHERE file_id = ?", (file_id,))
+
+            content_digest = hashlib.sha256()
+            size = 0
+
+            def blocks():
+                nonlocal size
+                for block in iter_document(file_path):
+                    content_digest.update(block.encode('utf-8'))
+                    size += len(block)
+                    yield block
+
+            num_kept = 0
+            added_ids = []
+            batch = []
+            for chunk_index, chunk in enumerate(self.chunker.iter_chunks(blocks())):
+                batch.append((chunk_index, (chunk.content, hash_text(chunk.content),
+                                            chunk.start_offset, chunk.end_offset, chunk.token_count)))
+                if len(batch) >= batch_chunks:
+                    num_kept += self._write_chunk_batch(file_id, batch, old_chunks, added_ids, on_chunks)
+                    batch = []
+            if batch:
+                num_kept += self._write_chunk_batch(file_id, batch, old_chunks, added_ids, on_chunks)
+
+            removed_ids = [chunk_id for ids in old_chunks.values() for chunk_id in ids]
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in removed_ids])
                 cursor.execute("""
-                    INSERT INTO files (name, size, created_at, updated_at)
-                    VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    ON CONFLICT(name) DO UPDATE SET
-                        size = excluded.size,
+                    UPDATE files SET size = ?, file_hash = ?, content_hash = ?, chunker = ?,
                         updated_at = CURRENT_TIMESTAMP
-                """, (file_name, len(content)))
-                
-                # Lấy file_id
-                cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
-                file_id = cursor.fetchone()[0]
-                
-                # Xóa chunks cũ và thêm chunks mới chỉ khi cần
-                cursor.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
-                for chunk_index, chunk in enumerate(chunks):
-                    cursor.execute("""
-                        INSERT INTO chunks (file_id, content, chunk_index, created_at)
-                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                    """, (file_id, chunk, chunk_index))
-                
-                conn.commit()
-                
+                    WHERE id = ?
+                """, (size, file_hash, content_digest.hexdigest(), self.chunker.signature, file_id))
+
+            print(f"Đã cập nhật file {file_name} (streaming): giữ {num_kept} chunks, "
+                  f"thêm {len(added_ids)} chunks, xóa {len(removed_ids)} chunks")
+            changed = bool(added_ids or removed_ids) or result is None
+            return {"changed": changed, "removed": removed_ids, "added": [] if on_chunks else added_ids}
         except Exception as e:
             print(f"Lỗi khi xử lý file {file_path}: {str(e)}")
             raise
 
-    def delete_file_from_db(self, file_name: str):
-        """Xóa dữ liệu của file khỏi database"""
-        try:
-            conn = sqlite3.connect(self.db_path)
+    def _write_chunk_batch(self, file_id: int, batch: list, old_chunks: dict, added_ids: list,
+                           on_chunks: Callable[[list, list], None] = None) -> int:
+        """Ghi một batch (chunk_index, chunk) của process_file_streaming
+
+        Chunk có hash trùng với chunk cũ được giữ lại, id của chunk mới được thêm vào added_ids.
+        Returns:
+            int: số chunk được giữ lại
+        """
+        kept, new_chunks = self._match_chunks(batch, old_chunks)
+
+        with self.connection() as conn:
             cursor = conn.cursor()
+            self._write_chunks(cursor, file_id, kept, new_chunks)
+            cursor.execute(
+                "SELECT chunk_index, id FROM chunks WHERE file_id = ? AND chunk_index BETWEEN ? AND ?",
+                (file_id, batch[0][0], batch[-1][0])
+            )
+            ids_by_index = dict(cursor.fetchall())
+
+        new_ids = [ids_by_index[chunk_index] for chunk_index, _ in new_chunks]
+        added_ids.extend(new_ids)
+        if on_chunks is not None and new_ids:
+            on_chunks(new_ids, [chunk[0] for _, chunk in new_chunks])
+        return len(kept)
+
+    def _match_chunks(self, indexed_chunks, old_chunks: dict) -> tuple:
+        """Ghép chunk mới (chunk_index, (content, chunk_hash, start, end, token_count)) với chunk cũ cùng hash
+
+        old_chunks {chunk_hash: [id]} được cập nhật tại chỗ, phần còn lại là các chunk cần xóa.
+        Returns:
+            tuple: (danh sách (chunk_index, chunk, id) được giữ lại, danh sách (chunk_index, chunk) mới)
+        """
+        kept = []
+        new_chunks = []
+        for chunk_index, chunk in indexed_chunks:
+            if old_chunks.get(chunk[1]):
+                kept.append((chunk_index, chunk, old_chunks[chunk[1]].pop(0)))
+            else:
+                new_chunks.append((chunk_index, chunk))
+        return kept, new_chunks
+
+    def _write_chunks(self, cursor, file_id: int, kept: list, new_chunks: list):
+        """Cập nhật vị trí của chunk được giữ lại và thêm các chunk mới"""
+        cursor.executemany(
+            "UPDATE chunks SET chunk_index = ?, start_offset = ?, end_offset = ?, token_count = ? WHERE id = ?",
+            [(chunk_index, chunk[2], chunk[3], chunk[4], chunk_id) for chunk_index, chunk, chunk_id in kept]
+        )
+        cursor.executemany("""
+            INSERT INTO chunks (file_id, content, chunk_hash, chunk_index, start_offset, end_offset, token_count, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, [(file_id, chunk[0], chunk[1], chunk_index, chunk[2], chunk[3], chunk[4])
+              for chunk_index, chunk in new_chunks])
+
+    def write_parsed_file(self, parsed: dict) -> dict:
+        """Ghi kết quả của parse_file vào database
+
+        Các chunk có cùng hash được giữ nguyên (kèm embedding), chỉ chunk mới được thêm vào.
+        Trả về dict gồm "changed", "removed" (id các chunk đã xóa) và "added" (id các chunk mới).
+        """
+        file_name = parsed["name"]
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            # File không thay đổi, không cần ghi lại
+            if parsed["status"] == "unchanged":
+                return {"changed": False, "removed": [], "added": []}
+
+            # File thay đổi nhưng văn bản trích xuất giữ nguyên (ví dụ chỉ đổi metadata của PDF)
+            if parsed["status"] == "same_content":
+                cursor.execute("UPDATE files SET file_hash = ? WHERE name = ?", (parsed["file_hash"], file_name))
+                return {"changed": False, "removed": [], "added": []}
+
+            # Thêm hoặc cập nhật thông tin file
+            cursor.execute("""
+                INSERT INTO files (name, size, file_hash, content_hash, chunker, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT(name) DO UPDATE SET
+                    size = excluded.size,
+                    file_hash = excluded.file_hash,
+                    content_hash = excluded.content_hash,
+                    chunker = excluded.chunker,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (file_name, parsed["size"], parsed["file_hash"], parsed["content_hash"], parsed["chunker"]))
             
-            try:
-                cursor.execute("BEGIN TRANSACTION")
+            # Lấy file_id
+            cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
+            file_id = cursor.fetchone()[0]
+            
+            # Gom các chunk cũ theo hash để tái sử dụng
+            cursor.execute("SELECT id, chunk_hash FROM chunks WHERE file_id = ? ORDER BY chunk_index", (file_id,))
+            old_chunks = {}
+            for chunk_id, chunk_hash in cursor.fetchall():
+                old_chunks.setdefault(chunk_hash, []).append(chunk_id)
+
+            kept, new_chunks = self._match_chunks(enumerate(parsed["chunks"]), old_chunks)
+            removed_ids = [chunk_id for ids in old_chunks.values() for chunk_id in ids]
+
+            # Xóa các chunk không còn, giữ lại chunk trùng nội dung (và embedding của nó)
+            cursor.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in removed_ids])
+            # Đặt chunk_index tạm thời là số âm để tránh trùng UNIQUE(file_id, chunk_index) khi sắp xếp lại
+            cursor.execute("UPDATE chunks SET chunk_index = -id WHERE file_id = ?", (file_id,))
+            self._write_chunks(cursor, file_id, kept, new_chunks)
+
+            # executemany không trả về lastrowid, lấy id của các chunk mới theo chunk_index
+            new_indexes = {chunk_index for chunk_index, _ in new_chunks}
+            cursor.execute("SELECT id, chunk_index FROM chunks WHERE file_id = ? ORDER BY chunk_index", (file_id,))
+            added_ids = [chunk_id for chunk_id, chunk_index in cursor.fetchall() if chunk_index in new_indexes]
+            print(f"Đã cập nhật file {file_name}: giữ {len(kept)} chunks, "
+                  f"thêm {len(added_ids)} chunks, xóa {len(removed_ids)} chunks")
+            return {"changed": True, "removed": removed_ids, "added": added_ids}
+
+    def delete_file_from_db(self, file_name: str) -> list:
+        """Xóa dữ liệu của file khỏi database, trả về id các chunk đã xóa"""
+        removed_ids = []
+        try:
+            # Kết nối từ pool tự rollback nếu có lỗi
+            with self.connection() as conn:
+                cursor = conn.cursor()
                 
                 # Lấy file_id
                 cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
@@ -237,50 +735,42 @@ class VectorDB:
                 
                 if result:
                     file_id = result[0]
+                    cursor.execute("SELECT id FROM chunks WHERE file_id = ?", (file_id,))
+                    removed_ids = [row[0] for row in cursor.fetchall()]
                     # Xóa chunks
                     cursor.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
                     # Xóa file
                     cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
                 
-                conn.commit()
-                print(f"Đã xóa dữ liệu của file {file_name} khỏi database")
-                
-            except Exception as e:
-                conn.rollback()
-                raise e
-            finally:
-                conn.close()
+            print(f"Đã xóa dữ liệu của file {file_name} khỏi database")
                 
         except Exception as e:
             print(f"Lỗi khi xóa dữ liệu của file {file_name}: {str(e)}")
+        return removed_ids
 
     def update_from_uploaded_files(self):
         """Đồng bộ dữ liệu từ uploaded_files vào VectorDB"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Lấy danh sách các file trong database
-            cursor.execute("SELECT name FROM files")
-            db_files = {row[0] for row in cursor.fetchall()}
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Lấy danh sách các file trong database
+                cursor.execute("SELECT name FROM files")
+                db_files = {row[0] for row in cursor.fetchall()}
             
             # Lấy danh sách các file trong thư mục uploaded_files
             uploaded_files = set()
             for file in os.listdir(self.uploaded_files_dir):
                 if file.endswith(('.txt', '.pdf', '.doc', '.docx', '.yaml', '.yml')):
                     uploaded_files.add(file)
-            
-            conn.close()
                     
             # Xóa dữ liệu của các file không còn tồn tại trong thư mục
             files_to_delete = db_files - uploaded_files
             for file_name in files_to_delete:
                 self.delete_file_from_db(file_name)
                 
-            # Cập nhật dữ liệu cho các file mới hoặc đã thay đổi
-            for file_name in uploaded_files:
-                file_path = os.path.join(self.uploaded_files_dir, file_name)
-                self.process_file(file_path)
+            # Cập nhật dữ liệu cho các file mới hoặc đã thay đổi (parse song song)
+            self.process_files([os.path.join(self.uploaded_files_dir, file_name) for file_name in sorted(uploaded_files)])
                     
         except Exception as e:
             print(f"Lỗi khi đồng bộ dữ liệu: {str(e)}")
@@ -288,10 +778,16 @@ class VectorDB:
     def reset_db(self):
         """Xóa và tạo lại database"""
         try:
-            # Xóa file database cũ nếu tồn tại
+            # Đóng các kết nối trong pool trước khi xóa file
+            self.pool.close_all()
+
+            # Xóa file database cũ (và các file WAL đi kèm) nếu tồn tại
             if os.path.exists(self.db_path):
                 os.remove(self.db_path)
                 print(f"Đã xóa database cũ: {self.db_path}")
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
             
             # Tạo database mới
             self.init_db()
@@ -303,29 +799,240 @@ class VectorDB:
     def get_chunk_by_id(self, doc_id: int) -> str:
         """Lấy nội dung chunk theo ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT content FROM chunks WHERE id = ?", (doc_id,))
-            result = cursor.fetchone()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT content FROM chunks WHERE id = ?", (doc_id,))
+                result = cursor.fetchone()
             return result[0] if result else None
         except Exception as e:
             print(f"Lỗi khi lấy chunk: {str(e)}")
             raise
 
+    def get_chunks_by_ids(self, chunk_ids: list) -> dict:
+        """Lấy nội dung nhiều chunk trong một truy vấn, trả về dict {chunk_id: content}"""
+        try:
+            chunk_ids = list(dict.fromkeys(int(chunk_id) for chunk_id in chunk_ids))
+            contents = {}
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                # Chia nhỏ danh sách id để không vượt quá giới hạn số tham số của SQLite
+                for start in range(0, len(chunk_ids), 500):
+                    batch = chunk_ids[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor.execute(f"SELECT id, content FROM chunks WHERE id IN ({placeholders})", batch)
+                    contents.update(cursor.fetchall())
+            return contents
+        except Exception as e:
+            print(f"Lỗi khi lấy chunks: {str(e)}")
+            raise
+
+    def get_chunk_details(self, chunk_ids: list) -> dict:
+        """Lấy nội dung kèm vị trí trong file của nhiều chunk
+
+        Returns:
+            dict: {chunk_id: dict(file_id, chunk_index, start_offset, end_offset, token_count, content)}
+        """
+        try:
+            chunk_ids = list(dict.fromkeys(int(chunk_id) for chunk_id in chunk_ids))
+            chunks = {}
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                for start in range(0, len(chunk_ids), 500):
+                    batch = chunk_ids[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor.execute(f"""
+                        SELECT id, file_id, chunk_index, start_offset, end_offset, token_count, content
+                        FROM chunks WHERE id IN ({placeholders})
+                    """, batch)
+                    for chunk_id, file_id, chunk_index, start_offset, end_offset, token_count, content in cursor.fetchall():
+                        chunks[chunk_id] = {
+                            "file_id": file_id,
+                            "chunk_index": chunk_index,
+                            "start_offset": start_offset,
+                            "end_offset": end_offset,
+                            "token_count": token_count,
+                            "content": content,
+                        }
+            return chunks
+        except Exception as e:
+            print(f"Lỗi khi lấy chunks: {str(e)}")
+            raise
+
+    def _filter_clause(self, filters: RetrievalFilters) -> tuple:
+        """Điều kiện SQL trên bảng files (alias f) của bộ lọc, trả về (sql, tham số)"""
+        conditions = []
+        params = []
+        if filters.file_names:
+            conditions.append(f"f.name IN ({','.join('?' * len(filters.file_names))})")
+            params.extend(filters.file_names)
+        if filters.extensions:
+            conditions.append("(" + " OR ".join("LOWER(f.name) LIKE ? ESCAPE '\\'" for _ in filters.extensions) + ")")
+            # Đuôi file được so khớp nguyên văn: %, _ và \ của người dùng không phải ký tự đại diện
+            params.extend("%" + LIKE_SPECIAL.sub(r"\\\g<0>", extension) for extension in filters.extensions)
+        if filters.updated_after:
+            conditions.append("f.updated_at >= ?")
+            params.append(filters.updated_after)
+        if filters.updated_before:
+            conditions.append("f.updated_at <= ?")
+            params.append(filters.updated_before)
+        return " AND ".join(conditions) or "1", params
+
+    def get_filtered_chunk_ids(self, filters: RetrievalFilters) -> np.ndarray:
+        """Id (int64) của các chunk thuộc các file thỏa bộ lọc"""
+        try:
+            clause, params = self._filter_clause(filters)
+            with self.connection() as conn:
+                rows = conn.execute(f"""
+                    SELECT c.id FROM chunks c JOIN files f ON f.id = c.file_id
+                    WHERE {clause} ORDER BY c.id
+                """, params).fetchall()
+            return np.array([row[0] for row in rows], dtype=np.int64)
+        except Exception as e:
+            print(f"Lỗi khi lọc chunks: {str(e)}")
+            raise
+
+    def get_filtered_embeddings(self, filters: RetrievalFilters, model_name: str):
+        """Id và embedding của các chunk thuộc các file thỏa bộ lọc (đã mã hóa bằng model_name)
+
+        Returns:
+            tuple: (mảng id int64, ma trận embedding float32 hoặc None nếu không có chunk nào)
+        """
+        try:
+            clause, params = self._filter_clause(filters)
+            with self.connection() as conn:
+                rows = conn.execute(f"""
+                    SELECT c.id, c.embedding, c.embedding_dim FROM chunks c JOIN files f ON f.id = c.file_id
+                    WHERE {clause} AND c.embedding IS NOT NULL AND c.embedding_model = ?
+                    ORDER BY c.id
+                """, params + [model_name]).fetchall()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            if not rows:
+                return ids, None
+            return ids, np.vstack([self._decode_embedding(blob, dim) for _, blob, dim in rows])
+        except Exception as e:
+            print(f"Lỗi khi lấy embeddings: {str(e)}")
+            raise
+
+    def _fts_query(self, query: str) -> str:
+        """Chuyển câu hỏi thành truy vấn FTS5: mỗi từ được đặt trong ngoặc kép và nối bằng OR
+
+        Ngoặc kép giữ nguyên các định danh như mã lỗi hay khóa YAML (ERR-1234, db.host)
+        dưới dạng cụm từ và tránh lỗi cú pháp FTS5 với ký tự đặc biệt.
+        """
+        terms = [term for term in query.split() if re.search(r"\w", term)]
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms[:64])
+
+    def search_bm25(self, queries: list, k: int, filters: RetrievalFilters = None) -> list:
+        """Tìm kiếm BM25 trên FTS5 cho nhiều câu hỏi
+
+        Với filters, điều kiện trên file được áp dụng trong cùng truy vấn FTS5 (trước LIMIT k).
+        Returns:
+            list: với mỗi câu hỏi, danh sách (chunk_id, điểm bm25) theo độ liên quan giảm dần
+        """
+        if not self.fts_enabled:
+            return [[] for _ in queries]
+        try:
+            results = []
+            join_sql, filter_sql, filter_params = "", "", []
+            if filters is not None:
+                # JOIN theo rowid nhanh hơn nhiều so với rowid IN (subquery) trên bảng FTS5
+                clause, filter_params = self._filter_clause(filters)
+                join_sql = "JOIN chunks c ON c.id = chunks_fts.rowid JOIN files f ON f.id = c.file_id"
+                filter_sql = f"AND {clause}"
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                for query in queries:
+                    fts_query = self._fts_query(query)
+                    if not fts_query:
+                        results.append([])
+                        continue
+                    # bm25() càng nhỏ càng liên quan
+                    cursor.execute(f"""
+                        SELECT chunks_fts.rowid, bm25(chunks_fts) FROM chunks_fts {join_sql}
+                        WHERE chunks_fts MATCH ? {filter_sql}
+                        ORDER BY bm25(chunks_fts)
+                        LIMIT ?
+                    """, [fts_query] + filter_params + [k])
+                    results.append(cursor.fetchall())
+            return results
+        except Exception as e:
+            print(f"Lỗi khi tìm kiếm BM25: {str(e)}")
+            raise
+
+    def save_embeddings(self, chunk_ids: list, vectors: np.ndarray, model_name: str):
+        """Lưu embedding của các chunk vào database"""
+        try:
+            vectors = np.asarray(vectors, dtype=self.embedding_dtype)
+            dim = vectors.shape[1]
+            with self.connection() as conn:
+                conn.executemany(
+                    "UPDATE chunks SET embedding = ?, embedding_model = ?, embedding_dim = ? WHERE id = ?",
+                    [(vector.tobytes(), model_name, dim, int(chunk_id)) for chunk_id, vector in zip(chunk_ids, vectors)]
+                )
+        except Exception as e:
+            print(f"Lỗi khi lưu embeddings: {str(e)}")
+            raise
+
+    def _decode_embedding(self, blob: bytes, dim: int) -> np.ndarray:
+        """Chuyển BLOB thành vector float32, nhận biết float16/float32 theo kích thước"""
+        dtype = np.float16 if len(blob) == dim * 2 else np.float32
+        return np.frombuffer(blob, dtype=dtype).astype(np.float32)
+
+    def get_embeddings(self, model_name: str):
+        """Lấy id và embedding của tất cả các chunk đã được mã hóa bằng model_name
+
+        Returns:
+            tuple: (mảng id int64, ma trận embedding float32)
+        """
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, embedding, embedding_dim FROM chunks
+                    WHERE embedding IS NOT NULL AND embedding_model = ?
+                    ORDER BY id
+                """, (model_name,))
+                rows = cursor.fetchall()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            if not rows:
+                return ids, None
+            vectors = np.vstack([self._decode_embedding(blob, dim) for _, blob, dim in rows])
+            return ids, vectors
+        except Exception as e:
+            print(f"Lỗi khi lấy embeddings: {str(e)}")
+            raise
+
+    def get_chunks_without_embedding(self, model_name: str, limit: int = -1, after_id: int = 0) -> list:
+        """Lấy các chunk chưa có embedding (hoặc embedding của model khác)
+
+        limit và after_id cho phép đọc theo từng trang (id tăng dần) thay vì toàn bộ một lần.
+        """
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, content FROM chunks
+                    WHERE (embedding IS NULL OR embedding_model IS NULL OR embedding_model != ?) AND id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (model_name, after_id, limit))
+                return cursor.fetchall()
+        except Exception as e:
+            print(f"Lỗi khi lấy chunks chưa có embedding: {str(e)}")
+            raise
+
     def get_all_chunks(self) -> list:
         """Lấy tất cả các chunks từ database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT c.id, c.content, f.name as source, c.chunk_index
-                FROM chunks c
-                JOIN files f ON f.id = c.file_id
-                ORDER BY f.name, c.chunk_index
-            """)
-            chunks = cursor.fetchall()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT c.id, c.content, f.name as source, c.chunk_index
+                    FROM chunks c
+                    JOIN files f ON f.id = c.file_id
+                    ORDER BY f.name, c.chunk_index
+                """)
+                chunks = cursor.fetchall()
             return chunks
         except Exception as e:
             print(f"Lỗi khi lấy chunks: {str(e)}")
@@ -334,17 +1041,16 @@ class VectorDB:
     def get_chunks_by_file(self, file_name: str) -> list:
         """Lấy tất cả chunks của một file"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT c.id, c.content, c.chunk_index
-                FROM chunks c
-                JOIN files f ON f.id = c.file_id
-                WHERE f.name = ?
-                ORDER BY c.chunk_index
-            """, (file_name,))
-            chunks = cursor.fetchall()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT c.id, c.content, c.chunk_index
+                    FROM chunks c
+                    JOIN files f ON f.id = c.file_id
+                    WHERE f.name = ?
+                    ORDER BY c.chunk_index
+                """, (file_name,))
+                chunks = cursor.fetchall()
             return chunks
         except Exception as e:
             print(f"Lỗi khi lấy chunks của file {file_name}: {str(e)}")
@@ -353,24 +1059,24 @@ class VectorDB:
     def get_all_files(self) -> list:
         """Lấy danh sách tất cả các file từ database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, name, size, created_at, updated_at
-                FROM files
-                ORDER BY name
-            """)
-            files = cursor.fetchall()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, name, size, created_at, updated_at
+                    FROM files
+                    ORDER BY name
+                """)
+                files = cursor.fetchall()
             return files
         except Exception as e:
             print(f"Lỗi khi lấy danh sách files: {str(e)}")
             raise
 
-    def delete_file_data(self, file_name: str):
-        """Xóa dữ liệu của file khỏi database"""
+    def delete_file_data(self, file_name: str) -> list:
+        """Xóa dữ liệu của file khỏi database, trả về id các chunk đã xóa"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            removed_ids = []
+            with self.connection() as conn:
                 cursor = conn.cursor()
                 
                 # Lấy file_id
@@ -379,13 +1085,15 @@ class VectorDB:
                 
                 if result:
                     file_id = result[0]
+                    cursor.execute("SELECT id FROM chunks WHERE file_id = ?", (file_id,))
+                    removed_ids = [row[0] for row in cursor.fetchall()]
                     # Xóa chunks
                     cursor.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
                     # Xóa file
                     cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
                     print(f"Đã xóa dữ liệu của file {file_name} khỏi database")
                 
-                conn.commit()
+                return removed_ids
                 
         except Exception as e:
             print(f"Lỗi khi xóa dữ liệu của file {file_name}: {str(e)}")
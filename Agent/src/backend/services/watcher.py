@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from typing import Callable
+
+# auto: watchdog (inotify/FSEvents/ReadDirectoryChangesW) nếu đã cài, ngược lại quét thư mục định kỳ
+FOLDER_WATCH_ENABLED = os.getenv("FOLDER_WATCH_ENABLED", "true").lower() == "true"
+FOLDER_WATCH_BACKEND = os.getenv("FOLDER_WATCH_BACKEND", "auto").lower()
+# Chờ đến khi không có sự kiện mới trong khoảng này (giây) mới xử lý, để gom các sự kiện liên tiếp
+FOLDER_WATCH_DEBOUNCE = float(os.getenv("FOLDER_WATCH_DEBOUNCE", "1.0"))
+FOLDER_WATCH_POLL_INTERVAL = float(os.getenv("FOLDER_WATCH_POLL_INTERVAL", "2.0"))
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Chuyển sự kiện của watchdog thành thao tác thêm/sửa hoặc xóa theo tên file"""
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.record(event.src_path, deleted=False)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.record(event.src_path, deleted=False)
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.watcher.record(event.src_path, deleted=False)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.watcher.record(event.src_path, deleted=True)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.record(event.src_path, deleted=True)
+            self.watcher.record(event.dest_path, deleted=False)
+
+
+class FolderWatcher:
+    """Theo dõi thư mục và chuyển các thay đổi (thêm/sửa/xóa file) cho on_changes
+
+    Sự kiện được gom theo tên file (sự kiện sau ghi đè sự kiện trước) và chỉ được xử lý khi
+    thư mục yên lặng trong debounce giây. Sự kiện đến trong lúc on_changes đang chạy được
+    giữ lại cho lần xử lý kế tiếp. on_changes(changed_paths, deleted_names) chỉ nhận các file
+    có định dạng trong extensions.
+    """
+
+    def __init__(self, folder: str, on_changes: Callable[[list, list], None], extensions: tuple,
+                 backend: str = FOLDER_WATCH_BACKEND, debounce: float = FOLDER_WATCH_DEBOUNCE,
+                 poll_interval: float = FOLDER_WATCH_POLL_INTERVAL):
+        self.folder = folder
+        self.on_changes = on_changes
+        self.extensions = extensions
+        if backend not in ("auto", "watchdog", "polling"):
+            raise ValueError(f"FOLDER_WATCH_BACKEND không hợp lệ: {backend} (hỗ trợ: auto, watchdog, polling)")
+        if backend == "watchdog" and Observer is None:
+            print("Chưa cài watchdog, chuyển sang quét thư mục định kỳ")
+        self.backend = "watchdog" if backend != "polling" and Observer is not None else "polling"
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # {tên file: True nếu đã bị xóa}
+        self._pending = {}
+        self._last_event = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._threads = []
+        self._snapshot = None
+        self.events = 0
+        self.flushes = 0
+        self.files_processed = 0
+        self.last_flush_seconds = None
+        self.last_error = None
+
+    def _accepts(self, file_name: str) -> bool:
+        # Bỏ qua file ẩn và file tạm của các upload đang ghi
+        return not file_name.startswith('.') and file_name.endswith(self.extensions)
+
+    def record(self, path: str, deleted: bool):
+        """Ghi nhận một thay đổi, file ngoài thư mục theo dõi hoặc không đúng định dạng bị bỏ qua"""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.folder):
+            return
+        file_name = os.path.basename(path)
+        if not self._accepts(file_name):
+            return
+        with self._lock:
+            self._pending[file_name] = deleted
+            self._last_event = time.monotonic()
+            self.events += 1
+
+    def start(self):
+        if self._threads:
+            return
+        if self.backend == "watchdog":
+            self._observer = Observer()
+            self._observer.schedule(_EventHandler(self), self.folder, recursive=False)
+            self._observer.start()
+        else:
+            self._snapshot = self._scan()
+            self._threads.append(threading.Thread(target=self._poll_loop, name="folder-poll", daemon=True))
+        self._threads.append(threading.Thread(target=self._flush_loop, name="folder-watch", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        print(f"Đang theo dõi thư mục {self.folder} ({self.backend})")
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        for thread in self._threads:
+            thread.join()
+
+    def _scan(self) -> dict:
+        """{tên file: (mtime_ns, kích thước)} của các file được theo dõi, một lần scandir"""
+        snapshot = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and self._accepts(entry.name):
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                snapshot = self._scan()
+            except OSError as e:
+                self.last_error = str(e)
+                continue
+            for file_name, signature in snapshot.items():
+                if self._snapshot.get(file_name) != signature:
+                    self.record(os.path.join(self.folder, file_name), deleted=False)
+            for file_name in self._snapshot.keys() - snapshot.keys():
+                self.record(os.path.join(self.folder, file_name), deleted=True)
+            self._snapshot = snapshot
+
+    def _flush_loop(self):
+        while not self._stop.wait(min(self.debounce, 0.5) or 0.1):
+            with self._lock:
+                if not self._pending or time.monotonic() - self._last_event < self.debounce:
+                    continue
+                pending, self._pending = self._pending, {}
+            self.flush(pending)
+
+    def flush(self, pending: dict):
+        """Chuyển các thay đổi đã gom cho on_changes"""
+        # File bị xóa rồi tạo lại trước khi xử lý được coi là đã sửa
+        deleted = sorted(name for name, is_deleted in pending.items()
+                         if is_deleted and not os.path.exists(os.path.join(self.folder, name)))
+        changed = sorted(os.path.join(self.folder, name) for name in pending if name not in deleted)
+        start_time = time.time()
+        try:
+            self.on_changes(changed, deleted)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Lỗi khi xử lý thay đổi thư mục: {str(e)}")
+        self.flushes += 1
+        self.files_processed += len(pending)
+        self.last_flush_seconds = round(time.time() - start_time, 4)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "backend": self.backend,
+            "events": self.events,
+            "pending": pending,
+            "flushes": self.flushes,
+            "files_processed": self.files_processed,
+            "last_flush_seconds": self.last_flush_seconds,
+            "last_error": self.last_error,
+        }
@@ -1,15 +1,101 @@
+import os
+import asyncio
 import requests
-from bs4 import BeautifulSoup
 from typing import List, Dict
 import json
 from fastapi import HTTPException
 import aiohttp
+from services.page_cache import get_page_cache, extract_text
+
+WEB_SEARCH_URL = os.getenv("WEB_SEARCH_URL", "https://api.duckduckgo.com/")
+# Giới hạn connection pool dùng chung: tổng số kết nối và số kết nối tới mỗi host
+WEB_MAX_CONNECTIONS = int(os.getenv("WEB_MAX_CONNECTIONS", "100"))
+WEB_MAX_CONNECTIONS_PER_HOST = int(os.getenv("WEB_MAX_CONNECTIONS_PER_HOST", "8"))
+WEB_CONNECT_TIMEOUT = float(os.getenv("WEB_CONNECT_TIMEOUT", "5"))
+WEB_READ_TIMEOUT = float(os.getenv("WEB_READ_TIMEOUT", "15"))
+# Trang lớn hơn số byte này bị từ chối thay vì đọc hết vào bộ nhớ
+WEB_MAX_RESPONSE_BYTES = int(os.getenv("WEB_MAX_RESPONSE_BYTES", str(5 * 1024 * 1024)))
+# Số trang được tải đồng thời trong get_pages
+WEB_FETCH_CONCURRENCY = int(os.getenv("WEB_FETCH_CONCURRENCY", "10"))
+DNS_CACHE_TTL = 300
+READ_CHUNK_SIZE = 64 * 1024
 
 class WebSearch:
-    def __init__(self):
+    def __init__(self, search_url: str = WEB_SEARCH_URL, max_connections: int = WEB_MAX_CONNECTIONS,
+                 max_connections_per_host: int = WEB_MAX_CONNECTIONS_PER_HOST,
+                 connect_timeout: float = WEB_CONNECT_TIMEOUT, read_timeout: float = WEB_READ_TIMEOUT,
+                 max_response_bytes: int = WEB_MAX_RESPONSE_BYTES, fetch_concurrency: int = WEB_FETCH_CONCURRENCY):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.search_url = search_url
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_response_bytes = max_response_bytes
+        self.fetch_concurrency = fetch_concurrency
+        # Văn bản của các trang đã tải, hỏi lại server bằng ETag/Last-Modified
+        self.page_cache = get_page_cache()
+        # Session được tạo ở request đầu tiên (cần event loop đang chạy) và dùng lại cho mọi request
+        self._session = None
+        self._session_loop = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Trả về ClientSession dùng chung: kết nối, DNS và TLS được tái sử dụng giữa các request"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                             limit_per_host=self.max_connections_per_host,
+                                             ttl_dns_cache=DNS_CACHE_TTL)
+            timeout = aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        """Đóng session và các kết nối trong pool (gọi khi tắt server)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    async def _read_body(self, response: aiohttp.ClientResponse) -> bytes:
+        """Đọc nội dung response, dừng lại khi vượt quá max_response_bytes"""
+        if response.content_length is not None and response.content_length > self.max_response_bytes:
+            raise HTTPException(status_code=413, detail=f"Trang quá lớn ({response.content_length} bytes)")
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+            body.extend(chunk)
+            if len(body) > self.max_response_bytes:
+                raise HTTPException(status_code=413, detail=f"Trang vượt quá {self.max_response_bytes} bytes")
+        return bytes(body)
+
+    async def _fetch_page(self, url: str, cached: Dict = None) -> Dict:
+        """Tải trang; nếu đã có bản cache thì gửi request có điều kiện (If-None-Match/If-Modified-Since)
+
+        Returns:
+            Dict: 'html', 'etag', 'last_modified' của trang, hoặc 'not_modified' khi server trả 304
+        """
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        session = await self.get_session()
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                return {'not_modified': True}
+            if response.status != 200:
+                raise HTTPException(status_code=response.status, detail=f"HTTP {response.status}")
+            body = await self._read_body(response)
+            encoding = response.charset or 'utf-8'
+            return {
+                'html': body.decode(encoding, errors='replace'),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
 
     async def search(self, query: str, num_results: int = 5) -> List[Dict]:
         """
@@ -24,12 +110,11 @@ class WebSearch:
         """
         try:
             # Sử dụng DuckDuckGo API
-            url = f"https://api.duckduckgo.com/?q={query}&format=json"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status != 200:
-                        raise HTTPException(status_code=response.status, detail="Lỗi khi tìm kiếm")
-                    data = await response.json()
+            session = await self.get_session()
+            async with session.get(self.search_url, params={"q": query, "format": "json"}) as response:
+                if response.status != 200:
+                    raise HTTPException(status_code=response.status, detail="Lỗi khi tìm kiếm")
+                data = json.loads(await self._read_body(response))
             
             results = []
             for result in data.get('Results', [])[:num_results]:
@@ -46,7 +131,8 @@ class WebSearch:
 
     async def get_page_content(self, url: str) -> str:
         """
-        Lấy nội dung của một trang web
+        Lấy nội dung của một trang web, dùng bản trong page cache khi trang còn mới
+        hoặc server xác nhận trang chưa thay đổi (304)
         
         Args:
             url (str): URL của trang web
@@ -55,24 +141,48 @@ class WebSearch:
             str: Nội dung đã được xử lý của trang web
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status != 200:
-                        raise HTTPException(status_code=response.status, detail="Lỗi khi lấy nội dung trang")
-                    html = await response.text()
-            
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # Loại bỏ các thẻ script và style
-            for script in soup(["script", "style"]):
-                script.decompose()
-                
-            text = soup.get_text()
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = ' '.join(chunk for chunk in chunks if chunk)
-            
+            cached = await asyncio.to_thread(self.page_cache.get, url) if self.page_cache is not None else None
+            if cached is not None and cached['fresh']:
+                self.page_cache.count("hits")
+                await asyncio.to_thread(self.page_cache.touch, url)
+                return cached['content']
+
+            page = await self._fetch_page(url, cached)
+            if page.get('not_modified'):
+                self.page_cache.count("revalidated")
+                await asyncio.to_thread(self.page_cache.touch, url, True)
+                return cached['content']
+
+            # Trích xuất văn bản trong thread để không chặn event loop với trang lớn
+            text = await asyncio.to_thread(extract_text, page['html'])
+            if self.page_cache is not None:
+                self.page_cache.count("misses")
+                await asyncio.to_thread(self.page_cache.set, url, text, page['etag'], page['last_modified'])
             return text
             
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Lỗi khi lấy nội dung trang: {str(e)}")
\ No newline at end of file
+            detail = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+            raise HTTPException(status_code=500, detail=f"Lỗi khi lấy nội dung trang: {detail}")
+
+    async def get_pages(self, urls: List[str], concurrency: int = None) -> List[Dict]:
+        """
+        Lấy nội dung nhiều trang web đồng thời, tối đa concurrency trang cùng lúc
+        
+        Args:
+            urls (List[str]): Danh sách URL
+            concurrency (int): Số trang tải đồng thời, mặc định là fetch_concurrency
+            
+        Returns:
+            List[Dict]: Theo thứ tự của urls, mỗi phần tử có 'url' và 'content' hoặc 'error'
+                        (trang lỗi không làm hỏng kết quả của các trang khác)
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.fetch_concurrency)
+
+        async def fetch(url: str) -> Dict:
+            async with semaphore:
+                try:
+                    return {'url': url, 'content': await self.get_page_content(url)}
+                except HTTPException as e:
+                    return {'url': url, 'error': e.detail}
+
+        return await asyncio.gather(*(fetch(url) for url in urls))